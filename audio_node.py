@@ -0,0 +1,354 @@
+"""Out-of-process audio node for music playback
+
+Reading from FFmpeg, scaling the volume and encoding to Opus all need the GIL,
+so with many guilds playing at once they compete with the bot's event loop. An
+audio node is a separate process that does all of this and streams ready Opus
+packets back over a local socket. Run several of them to spread playback over
+more cores.
+
+Protocol (one TCP connection per source):
+    client -> node: a JSON line with the source url
+        {"source": ..., "volume": 1.0, "codec": "opus" or null, "secret": ...}
+        (codec is "opus" if the source is already Opus so it's copied)
+    node -> client: a JSON line saying if the source was created
+        {"ok": true, "volume": <whether the volume can change>}
+        {"ok": false, "error": "..."}
+    node -> client: Opus packets, each prefixed by its length as a 2 byte
+        big endian integer. A length of 0 means the source ended.
+    client -> node: JSON lines while playing, like {"volume": 0.5} or
+        {"played": 150} (the number of packets played so far)
+
+The node sends at most WINDOW packets more than the client says it played, so
+audio doesn't pile up in socket buffers ahead of playback and volume changes
+are heard within WINDOW frames.
+
+Nodes only play http(s) urls with the fixed FFMPEG_OPTIONS, so clients can't
+choose what goes on FFmpeg's command line. If JOSHGONE_AUDIO_NODE_SECRET is
+set, requests must include it (set it on both the node and the bot). Nodes
+only listen on loopback addresses unless there's a secret.
+
+Example:
+    $ python audio_node.py --port 8765 --processes 4
+    $ export JOSHGONE_AUDIO_NODES=127.0.0.1:8765,127.0.0.1:8766,...
+
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import socket
+import socketserver
+import struct
+import multiprocessing
+
+import discord
+
+import patched_player
+
+# Options passed to FFmpeg, both here and when the bot plays in-process
+FFMPEG_OPTIONS = {
+    "options": "-vn",
+    # Source: https://stackoverflow.com/questions/66070749/
+    "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
+}
+
+# Packets (20ms each) the node can send ahead of what the client played
+WINDOW = 25
+# The client reports how many packets it played every this many packets
+ACK_FRAMES = 5
+
+# - Client
+
+class NodeAudio(discord.AudioSource):
+    """Audio source that plays Opus packets sent from an audio node
+
+    Use NodeAudio.connect to create one. Connecting is blocking, so call it
+    from a thread when on the event loop.
+
+    """
+    def __init__(self, sock, *, supports_volume, volume=1.0, on_cleanup=None):
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        self._volume = volume
+        self._ended = False
+        self._played = 0
+        # Volume changes and acks are sent from different threads
+        self._send_lock = threading.Lock()
+        self.supports_volume = supports_volume
+        self._on_cleanup = on_cleanup
+
+    @classmethod
+    def connect(
+        cls,
+        address,
+        source,
+        *,
+        volume=1.0,
+        codec=None,
+        secret=None,
+        timeout=10,
+        on_cleanup=None,
+    ):
+        if secret is None:
+            secret = os.environ.get("JOSHGONE_AUDIO_NODE_SECRET")
+        sock = socket.create_connection(address, timeout=timeout)
+        try:
+            request = {
+                "source": source,
+                "volume": volume,
+                "codec": codec,
+                "secret": secret,
+            }
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            audio = cls(
+                sock,
+                supports_volume=False,
+                volume=volume,
+                on_cleanup=on_cleanup,
+            )
+            response = json.loads(audio._file.readline() or b"null")
+            if response is None:
+                raise discord.ClientException("audio node closed the connection")
+            if not response["ok"]:
+                raise discord.ClientException(f"audio node error: {response['error']}")
+            audio.supports_volume = response["volume"]
+            # The timeout is only for connecting. FFmpeg can take a while
+            # (like when reconnecting to a stream) and reads in the player's
+            # thread shouldn't fail because of it.
+            sock.settimeout(None)
+            return audio
+        except BaseException:
+            sock.close()
+            raise
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(value, 0.0)
+        if self.supports_volume:
+            self._send_json({"volume": self._volume})
+
+    def _send_json(self, message):
+        data = json.dumps(message).encode() + b"\n"
+        try:
+            with self._send_lock:
+                self._sock.sendall(data)
+        except (OSError, AttributeError):
+            pass  # The source was cleaned up
+
+    def is_opus(self):
+        return True
+
+    def read(self):
+        if self._ended:
+            return b""
+        header = self._file.read(2)
+        length = int.from_bytes(header, "big")
+        if len(header) < 2 or length == 0:
+            self._ended = True
+            return b""
+        packet = self._file.read(length)
+        if len(packet) < length:
+            self._ended = True
+            return b""
+        self._played += 1
+        if self._played % ACK_FRAMES == 0:
+            self._send_json({"played": self._played})
+        return packet
+
+    def cleanup(self):
+        if self._sock is None:
+            return
+        try:
+            self._file.close()
+            self._sock.close()
+        finally:
+            self._sock = None
+            if self._on_cleanup is not None:
+                self._on_cleanup()
+
+def parse_addresses(text):
+    """Returns a list of (host, port) from "host:port,host:port,..." """
+    addresses = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        host, _, port = part.rpartition(":")
+        addresses.append((host or "127.0.0.1", int(port)))
+    return addresses
+
+# - Node
+
+def _make_source(request):
+    source = request["source"]
+    if not isinstance(source, str) or not source.startswith(("http://", "https://")):
+        raise ValueError("source must be an http(s) url")
+    kwargs = dict(FFMPEG_OPTIONS)
+    volume = float(request.get("volume", 1.0))
+    if volume == 1:
+        # Let FFmpeg copy or encode the Opus packets itself
+        codec = patched_player.opus_codec(request.get("codec"))
+        return patched_player.FFmpegOpusAudio(source, codec=codec, **kwargs)
+    audio = patched_player.FFmpegPCMAudio(source, **kwargs)
+    return patched_player.PCMVolumeTransformer(audio, volume=volume)
+
+class _NodeHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            secret = self.server.secret
+            if secret is not None and not hmac.compare_digest(
+                str(request.get("secret") or "").encode(), secret.encode(),
+            ):
+                raise PermissionError("wrong secret")
+            source = _make_source(request)
+        except Exception as e:
+            self._send_json({"ok": False, "error": repr(e)})
+            return
+        try:
+            supports_volume = isinstance(source, discord.PCMVolumeTransformer)
+            self._send_json({"ok": True, "volume": supports_volume})
+            # Handle volume changes and acks while playing
+            acked = threading.Condition()
+            played = 0
+            def _control():
+                nonlocal played
+                try:
+                    for line in self.rfile:
+                        try:
+                            message = json.loads(line)
+                        except ValueError:
+                            continue
+                        if supports_volume and "volume" in message:
+                            source.volume = message["volume"]
+                        if "played" in message:
+                            with acked:
+                                played = message["played"]
+                                acked.notify()
+                except OSError:
+                    pass  # The client disconnected
+                finally:
+                    # The client is gone so stop waiting for it
+                    with acked:
+                        played = float("inf")
+                        acked.notify()
+            threading.Thread(target=_control, daemon=True).start()
+            encoder = None
+            if not source.is_opus():
+                encoder = discord.opus.Encoder()
+            pack = struct.Struct(">H").pack
+            write = self.wfile.write
+            sent = 0
+            while True:
+                with acked:
+                    acked.wait_for(lambda: sent - played < WINDOW)
+                data = source.read()
+                if not data:
+                    break
+                if encoder is not None:
+                    data = encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+                write(pack(len(data)) + data)
+                sent += 1
+            write(b"\0\0")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped playing
+        finally:
+            source.cleanup()
+
+    def _send_json(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+
+class _NodeServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    secret = None
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def serve(host, port, *, secret=None):
+    """Runs an audio node until interrupted
+
+    Requests must include secret if it's given. Without one, host has to be a
+    loopback address.
+
+    """
+    if secret is None and not _is_loopback(host):
+        raise ValueError("audio nodes need a secret to listen on non-loopback addresses")
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+    with _NodeServer((host, port), _NodeHandler) as server:
+        server.secret = secret
+        print(f"Audio node listening on {host}:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+# - Command line
+
+parser = argparse.ArgumentParser(
+    description="Runs audio nodes that stream Opus packets to JoshGone.",
+)
+parser.add_argument(
+    "--host",
+    default="127.0.0.1",
+    help=(
+        "address to listen on (default is 127.0.0.1). Other addresses than"
+        " loopback need --secret"
+    ),
+)
+parser.add_argument(
+    "--port",
+    type=int,
+    default=8765,
+    help="port of the first node (default is 8765)",
+)
+parser.add_argument(
+    "--processes",
+    type=int,
+    default=1,
+    help="number of nodes to run on consecutive ports (default is 1)",
+)
+parser.add_argument(
+    "--secret",
+    default=os.environ.get("JOSHGONE_AUDIO_NODE_SECRET") or None,
+    help=(
+        "secret that requests must include (default is the"
+        " JOSHGONE_AUDIO_NODE_SECRET environment variable)"
+    ),
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.secret is None and not _is_loopback(args.host):
+        parser.error("--secret is needed to listen on non-loopback addresses")
+    if args.processes == 1:
+        serve(args.host, args.port, secret=args.secret)
+    else:
+        processes = [
+            multiprocessing.Process(
+                target=serve,
+                args=(args.host, args.port + i),
+                kwargs={"secret": args.secret},
+            )
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
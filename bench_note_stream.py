@@ -0,0 +1,65 @@
+import argparse
+import io
+import random
+import time
+
+import online_sequencer_make_chunks as make_chunks
+import online_sequencer_note_stream as ns
+
+def _random_note_infos(count):
+    rng = random.Random(0)
+    note_infos = []
+    time_ = 0.0
+    for i in range(count):
+        time_ += rng.choice((0, 0, 0.125, 0.25))
+        note_infos.append({
+            "instrument": rng.randrange(56),
+            "type": rng.choice(ns.NOTE_TYPES[24:84]),
+            "time": time_,
+            "length": rng.choice((0.125, 0.25, 0.5, 1)),
+            "volume": rng.random(),
+            "detune": rng.choice((0, 0, 0, -25.5, 12)),
+        })
+    note_infos[0]["sorted"] = 1
+    return note_infos
+
+def bench_format(name, note_infos):
+    """Returns the seconds taken to write, the seconds taken to read and the
+    size in bytes of the note infos in the format"""
+    if name == "binary":
+        write, read = ns.write_note_infos, ns.read_note_infos
+    else:
+        write = ns.write_note_infos_json
+        read = lambda read: make_chunks._stream_read_json_array(
+            lambda: read(2048)
+        )
+    file = io.BytesIO()
+    start = time.perf_counter()
+    write(file.write, note_infos)
+    written = time.perf_counter()
+    file.seek(0)
+    count = sum(1 for _ in read(file.read))
+    end = time.perf_counter()
+    assert count == len(note_infos)
+    return written - start, end - written, len(file.getvalue())
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks the note info formats sent to the renderer.",
+)
+parser.add_argument(
+    "--notes",
+    type=int,
+    default=100_000,
+    help="number of notes in the song (default is 100000)",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    note_infos = _random_note_infos(args.notes)
+    for name in ns.FORMATS:
+        write, read, size = bench_format(name, note_infos)
+        print(
+            f"{name:>8}: write {write * 1000:8.1f}ms,"
+            f" read {read * 1000:8.1f}ms,"
+            f" {size / 1e6:6.2f}MB"
+        )
@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+
+import protobufast as pf
+import online_sequencer_get_note_infos as os_note_infos
+
+def _random_sequence(count):
+    rng = random.Random(0)
+    notes = []
+    time_ = 0.0
+    for i in range(count):
+        time_ += rng.choice((0, 0, 1, 2))
+        notes.append(os_note_infos.Note(
+            type=os_note_infos.NoteType(rng.randrange(24, 84)),
+            time=time_,
+            length=rng.choice((1.0, 2.0, 4.0)),
+            instrument=rng.randrange(56),
+            volume=rng.choice((1.0, 0.5, 0.25)),
+        ))
+    settings = os_note_infos.SequenceSettings(
+        bpm=110,
+        instruments=[
+            os_note_infos.InstrumentSettingsPair(
+                key=instrument,
+                value=os_note_infos.InstrumentSettings(volume=0.5, detune=12),
+            )
+            for instrument in range(0, 56, 7)
+        ],
+    )
+    return os_note_infos.Sequence(settings=settings, notes=notes).dumps()
+
+def _timed(func, data, repeat):
+    # Returns the best time of a few runs and the result
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _skim_only(data):
+    return sum(1 for _ in pf.skim(data, 0, len(data)))
+
+DECODERS = {
+    "pure_protobuf": os_note_infos.Sequence.loads,
+    "compiled": os_note_infos.FastSequence.decode,
+    "compiled tuples": os_note_infos.FastSequence.decode_tuple,
+    "skim only": _skim_only,
+}
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks decoding an Online Sequencer sequence.",
+)
+parser.add_argument(
+    "--notes",
+    type=int,
+    default=100_000,
+    help="number of notes in the sequence (default is 100000)",
+)
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=1,
+    help="number of runs to take the best time of (default is 1)",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data = _random_sequence(args.notes)
+    print(f"Sequence with {args.notes} notes, {len(data) / 1e6:.2f}MB")
+    results = {}
+    for name, decode in DECODERS.items():
+        seconds, results[name] = _timed(decode, data, args.repeat)
+        print(f"{name:>16}: {seconds * 1000:8.1f}ms")
+    # Check that the compiled decoder agrees with pure_protobuf
+    expected = results["pure_protobuf"].notes
+    actual = results["compiled"].notes
+    assert len(expected) == len(actual)
+    for expected_note, actual_note in zip(expected, actual):
+        assert (
+            expected_note.type, expected_note.time, expected_note.length,
+            expected_note.instrument, expected_note.volume,
+        ) == (
+            actual_note.type, actual_note.time, actual_note.length,
+            actual_note.instrument, actual_note.volume,
+        )
@@ -0,0 +1,114 @@
+import argparse
+import importlib.util
+import time
+import shutil
+import subprocess
+import random
+
+try:
+    import resource
+except ImportError:
+    has_resource = False  # Windows
+else:
+    has_resource = True
+
+import discord
+
+import patched_player
+
+FRAME_BYTES = 3840  # 20ms of 16-bit stereo 48kHz audio
+
+class _FramesSource(discord.AudioSource):
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+
+    def read(self):
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        return frame
+
+def _random_frames(count):
+    rng = random.Random(0)
+    return [rng.randbytes(FRAME_BYTES) for _ in range(count)]
+
+def bench_transformer(make_transformer, frames, count):
+    """Returns the seconds of CPU time used per frame"""
+    transformer = make_transformer(_FramesSource(frames))
+    start = time.process_time()
+    for i in range(count):
+        if i % 250 == 0:
+            # Change volume every 5 seconds of audio to include ramps
+            transformer.volume = 0.5 if transformer.volume != 0.5 else 0.8
+        transformer.read()
+    return (time.process_time() - start) / count
+
+def bench_ffmpeg(seconds, volume):
+    """Returns the seconds of FFmpeg CPU time used per frame"""
+    def _run(filters):
+        args = [
+            "ffmpeg", "-nostdin", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+            *filters,
+            "-f", "s16le", "-ar", "48000", "-ac", "2", "-",
+        ]
+        def _children_cpu():
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            return usage.ru_utime + usage.ru_stime
+        start = _children_cpu()
+        subprocess.run(args, stdout=subprocess.DEVNULL, check=True)
+        return _children_cpu() - start
+    base = _run([])
+    filtered = _run(["-af", f"volume={volume}"])
+    return max(0.0, filtered - base) / (seconds * 50)
+
+def _report(name, per_frame):
+    # 50 frames per second of audio
+    print(
+        f"{name:>24}: {per_frame * 1e6:8.2f}us per frame,"
+        f" {per_frame * 50 * 1000:7.3f}ms CPU per second of audio"
+    )
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks volume control for 20ms PCM frames.",
+)
+parser.add_argument(
+    "--frames",
+    type=int,
+    default=50 * 60,
+    help="number of frames to process (default is one minute of audio)",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    frames = _random_frames(64)
+
+    if importlib.util.find_spec("audioop") is None:
+        print(f"{'builtin (audioop)':>24}: skipped (no audioop)")
+    else:
+        _report("builtin (audioop)", bench_transformer(
+            discord.PCMVolumeTransformer, frames, args.frames,
+        ))
+
+    if patched_player.has_numpy:
+        _report("patched (numpy)", bench_transformer(
+            patched_player.PCMVolumeTransformer, frames, args.frames,
+        ))
+    else:
+        print(f"{'patched (numpy)':>24}: skipped (no numpy)")
+
+    has_numpy = patched_player.has_numpy
+    patched_player.has_numpy = False
+    try:
+        _report("patched (python)", bench_transformer(
+            patched_player.PCMVolumeTransformer, frames, args.frames // 10,
+        ))
+    finally:
+        patched_player.has_numpy = has_numpy
+
+    if shutil.which("ffmpeg") is None:
+        print(f"{'ffmpeg filter':>24}: skipped (no ffmpeg)")
+    elif not has_resource:
+        print(f"{'ffmpeg filter':>24}: skipped (can't measure FFmpeg's CPU time)")
+    else:
+        _report("ffmpeg filter", bench_ffmpeg(args.frames / 50, 0.5))
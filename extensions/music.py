@@ -1,33 +1,195 @@
 # Source: https://github.com/Rapptz/discord.py/blob/master/examples/basic_voice.py
 
 import asyncio
-import random
 import typing
 import traceback
 import json
-import queue
-import threading
 import os
 import sys
 import shlex
+import time
+import zlib
+import contextlib
 from collections import deque
 
+import aiosqlite
 import discord
 from discord.ext import commands
 from discord.ext import tasks
 
 import yt_dlp as youtube_dl
 
+import audio_node
 import patched_player
+from indexed_queue import IndexedQueue
+from jitter_buffer import JitterBuffer
+import online_sequencer_note_stream as note_stream
 import soundit as s
 
 try:
     import online_sequencer_get_note_infos as os_note_infos
+    import online_sequencer_cache as os_cache
 except ImportError:
     has_os = False
 else:
     has_os = True
 
+# Song types that can be saved (raw sources only live in memory)
+_SNAPSHOT_TYPES = ("stream", "local", "os")
+
+def _encode_snapshot(info):
+    """Returns a compressed snapshot of a guild's queue state"""
+    def _pair(song):
+        if song is None or song["ty"] not in _SNAPSHOT_TYPES:
+            return None
+        return [song["ty"], song["query"]]
+    songs = [pair for pair in map(_pair, info["queue"]) if pair is not None]
+    snapshot = [
+        1,  # Snapshot format version
+        info["channel_id"],
+        info["loop"],
+        _pair(info["current"]),
+        songs,
+    ]
+    return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode())
+
+def _decode_snapshot(data):
+    """Returns a dict of queue state from a snapshot"""
+    version, channel_id, loop, current, songs = json.loads(zlib.decompress(data))
+    if version != 1:
+        raise ValueError(f"unknown snapshot version: {version}")
+    def _song(pair):
+        return None if pair is None else {"ty": pair[0], "query": pair[1]}
+    return {
+        "channel_id": channel_id,
+        "loop": loop,
+        "current": _song(current),
+        "queue": map(_song, songs),
+    }
+
+class _AudioStats:
+    """Counters for the audio pipeline of one song (times are in seconds)"""
+
+    __slots__ = (
+        "mode", "frames",
+        "read_total", "read_max",
+        "encode_total", "encode_max",
+        "late_max", "misses", "underruns",
+        "fill_last", "fill_min",
+    )
+
+    # A frame is late once it's read this long after its deadline
+    MISS_THRESHOLD = 0.020
+    # Reads slower than a whole frame mean the source couldn't keep up
+    UNDERRUN_THRESHOLD = 0.020
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.frames = 0
+        self.read_total = self.read_max = 0.0
+        self.encode_total = self.encode_max = 0.0
+        self.late_max = 0.0
+        self.misses = self.underruns = 0
+        self.fill_last = self.fill_min = None
+
+    def summary(self):
+        frames = self.frames or 1
+        parts = [
+            f"{self.mode} {self.frames} frames",
+            f"read avg {self.read_total / frames * 1000:.2f}ms"
+            f" max {self.read_max * 1000:.1f}ms",
+            f"encode avg {self.encode_total / frames * 1000:.2f}ms"
+            f" max {self.encode_max * 1000:.1f}ms",
+            f"{self.misses} deadline misses"
+            f" (max {self.late_max * 1000:.0f}ms late)",
+            f"{self.underruns} underruns",
+        ]
+        if self.fill_last is not None:
+            parts.append(
+                f"buffer {self.fill_last:.0%} (min {self.fill_min:.0%})"
+            )
+        return " | ".join(parts)
+
+class _MeteredSource(discord.AudioSource):
+    """Audio source wrapper that measures the player thread's work
+
+    Reads are timed directly, including any volume scaling since this wraps
+    the PCMVolumeTransformer. The player thread's CPU time between the end of
+    one read and the start of the next covers encoding and sending that
+    frame. Frames are expected every 20ms from the first read,
+    and reads much later than that count as deadline misses.
+
+    The CPU seconds and frame count are also added to cpu in place. This is
+    only the player thread's CPU, not FFmpeg's.
+
+    """
+    def __init__(self, source, stats, cpu):
+        self.source = source
+        self.stats = stats
+        self.cpu = cpu
+        # Find the buffer fill level and underrun functions if the source has
+        # them (a buffered source plays silence instead of blocking, so its
+        # reads are never slow)
+        inner = source
+        while not hasattr(inner, "buffer_fill") and hasattr(inner, "original"):
+            inner = inner.original
+        self._buffer_fill = getattr(inner, "buffer_fill", None)
+        self._buffer_underruns = getattr(inner, "buffer_underruns", None)
+        self._last_buffer_underruns = 0
+        self._first_time = None
+        self._last_cpu = None
+        self._last_end_cpu = None
+
+    def read(self):
+        stats = self.stats
+        now = time.perf_counter()
+        now_cpu = time.thread_time()
+        if self._last_cpu is not None:
+            encode = now_cpu - self._last_end_cpu
+            stats.encode_total += encode
+            stats.encode_max = max(stats.encode_max, encode)
+            self.cpu[0] += now_cpu - self._last_cpu
+            self.cpu[1] += 1
+        # Restart the schedule on the first read and after long gaps (pausing)
+        late = 0.0
+        if self._first_time is not None:
+            late = now - (self._first_time + stats.frames * 0.02)
+        if self._first_time is None or late > 1:
+            self._first_time = now - stats.frames * 0.02
+            late = 0.0
+        if late > stats.MISS_THRESHOLD:
+            stats.misses += 1
+        stats.late_max = max(stats.late_max, late)
+        self._last_cpu = now_cpu
+        data = self.source.read()
+        end = time.perf_counter()
+        self._last_end_cpu = time.thread_time()
+        read = end - now
+        stats.frames += 1
+        stats.read_total += read
+        stats.read_max = max(stats.read_max, read)
+        if read > stats.UNDERRUN_THRESHOLD:
+            stats.underruns += 1
+        if self._buffer_fill is not None:
+            fill = self._buffer_fill()
+            stats.fill_last = fill
+            if stats.fill_min is None or fill < stats.fill_min:
+                stats.fill_min = fill
+        if self._buffer_underruns is not None:
+            underruns = self._buffer_underruns()
+            stats.underruns += underruns - self._last_buffer_underruns
+            self._last_buffer_underruns = underruns
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+# Final snapshot writes started by Music.cog_unload
+_flush_tasks = set()
+
 class Music(commands.Cog):
     # Options that are passed to youtube-dl
     _DEFAULT_YTDL_OPTS = {
@@ -44,14 +206,21 @@ class Music(commands.Cog):
         'default_search': 'auto',
         'source_address': '0.0.0.0', # bind to ipv4 since ipv6 addresses cause issues sometimes
     }
-    # Options passed to FFmpeg
-    _DEFAULT_FFMPEG_OPTS = {
-        'options': '-vn',
-        # Source: https://stackoverflow.com/questions/66070749/
-        "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
-    }
+    # Options passed to FFmpeg (audio nodes only play with these)
+    _DEFAULT_FFMPEG_OPTS = audio_node.FFMPEG_OPTIONS
 
     ONLINE_SEQUENCER_URL_PREFIX = "https://onlinesequencer.net/"
+    # Seconds to wait for an Online Sequencer song to start rendering
+    OS_START_TIMEOUT = 30
+
+    # Number of songs shown per page of %queue
+    QUEUE_PAGE_SIZE = 20
+    # Maximum number of playlist entries queued at once while loading
+    PLAYLIST_BATCH_SIZE = 100
+    # Seconds to skip an audio node for after it couldn't be reached
+    AUDIO_NODE_RETRY = 60
+    # Seconds to wait after a change before saving queue snapshots
+    SNAPSHOT_DELAY = 5
 
     def __init__(
         self,
@@ -61,6 +230,12 @@ class Music(commands.Cog):
         ffmpeg_opts=_DEFAULT_FFMPEG_OPTS,
         os_python_executable=None,
         os_directory=None,
+        os_note_format=None,
+        os_cache_size=None,
+        os_render_workers=None,
+        os_max_voices=None,
+        volume_filter=None,
+        audio_nodes=None,
     ):
         self.bot = bot
         # Options are stores on the instance in case they need to be changed
@@ -69,13 +244,31 @@ class Music(commands.Cog):
         # Data is persistent between extension reloads
         if not hasattr(bot, "_music_data"):
             bot._music_data = {}
-        if not hasattr(bot, "_music_advance_queue"):
-            bot._music_advance_queue = asyncio.Queue()
         self.data = bot._music_data
-        self.advance_queue = bot._music_advance_queue
-        # Start the advancer's auto-restart task
-        self.advance_task = None
-        self.advancer.start()
+        # Each active guild gets its own advancer task which sleeps on an
+        # event until something is scheduled
+        self.advancers = {}
+        self.advance_events = {}
+        # Restart advancers for guilds that had advances pending when the
+        # extension was reloaded
+        for guild_id, info in self.data.items():
+            if info.get("pending"):
+                self.start_advancer(guild_id)
+        # Guilds whose saved queue was already checked (only done once per
+        # process so a stale snapshot isn't loaded after %leave)
+        if not hasattr(bot, "_music_restored"):
+            bot._music_restored = set()
+        self.restored = bot._music_restored
+        # Guilds whose queue changed since the last snapshot
+        self.dirty = set()
+        self.snapshot_task = None
+        # Event loop lag (how late sleeps wake up) for %audiostats
+        self.loop_lag_last = self.loop_lag_max = 0.0
+        self.loop_lag_task = asyncio.create_task(
+            self.measure_loop_lag(),
+            name="music_loop_lag",
+        )
+        self.audio_stats_logger.start()
         # The name of the Python executable we should use for Online Sequencer
         if os_python_executable is None:
             os_python_executable = os.environ.get(
@@ -90,72 +283,284 @@ class Music(commands.Cog):
                 "oscollection",
             )
         self.os_directory = os_directory
+        # How note infos are sent to the renderer, "binary" or "json" (see
+        # online_sequencer_note_stream.py)
+        if os_note_format is None:
+            os_note_format = os.environ.get("JOSHGONE_OS_NOTE_FORMAT", "binary")
+        if os_note_format not in note_stream.FORMATS:
+            raise ValueError(f"unknown note format: {os_note_format!r}")
+        self.os_note_format = os_note_format
+        # Number of processes the renderer mixes time segments of a song in
+        # (see mix_segments in online_sequencer_make_chunks.py)
+        if os_render_workers is None:
+            os_render_workers = int(os.environ.get("JOSHGONE_OS_RENDER_WORKERS", "1"))
+        self.os_render_workers = os_render_workers
+        # Most notes that can play at once in a song (0 for no limit). The
+        # oldest notes are stopped first when there are too many.
+        if os_max_voices is None:
+            os_max_voices = int(os.environ.get("JOSHGONE_OS_MAX_VOICES", "256"))
+        self.os_max_voices = os_max_voices
+        # On-disk cache of parsed notes and rendered songs (see
+        # online_sequencer_cache.py). The size is the cap for rendered audio
+        # in bytes, and 0 turns the cache off. Options that change the
+        # rendered audio are part of the cache key.
+        if os_cache_size is None:
+            os_cache_size = int(os.environ.get("JOSHGONE_OS_CACHE_SIZE", "1024")) * 2**20
+        self.os_cache = None
+        if has_os and os_cache_size > 0 and os.path.isdir(os_directory):
+            self.os_cache = os_cache.OSCache(
+                f"{os_directory}/cache",
+                f"{os_directory}/settings.json",
+                audio_size=os_cache_size,
+                render_options={"voices": os_max_voices},
+            )
+        # Whether streams not at 100% volume should have FFmpeg apply the
+        # volume (and encode to Opus) instead of scaling PCM in the player
+        # thread. The volume then can't change until the next song.
+        if volume_filter is None:
+            volume_filter = bool(int(os.environ.get("JOSHGONE_VOLUME_FILTER", "0")))
+        self.volume_filter = volume_filter
+        # Addresses of audio nodes to play streams from (see audio_node.py).
+        # Streams are played in this process if there are none.
+        if audio_nodes is None:
+            audio_nodes = audio_node.parse_addresses(
+                os.environ.get("JOSHGONE_AUDIO_NODES", "")
+            )
+        self.audio_nodes = audio_nodes
+        self.audio_node_load = {address: 0 for address in audio_nodes}
+        # Maps unreachable nodes to when they can be tried again
+        self.audio_node_down = {}
 
-    # Cancel just the advancer and the auto-restart tasks
+    # Cancel all advancer tasks (pending advances are kept in the data)
+    # (this is sync since discord.py 1.x doesn't await it)
     def cog_unload(self):
-        self.advancer.cancel()
+        self.loop_lag_task.cancel()
+        self.audio_stats_logger.cancel()
+        for task in self.advancers.values():
+            task.cancel()
+        self.advancers.clear()
+        self.advance_events.clear()
+        # Save any unsaved changes right away
+        previous, self.snapshot_task = self.snapshot_task, None
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.create_task(
+            self._flush_snapshots(previous),
+            name="music_snapshots_flush",
+        )
+        # The loop only keeps weak references to tasks
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+
+    # Waits for the cancelled write (which puts its guilds back into
+    # self.dirty) and writes everything that's left
+    async def _flush_snapshots(self, previous):
+        if previous is not None:
+            with contextlib.suppress(asyncio.CancelledError):
+                await previous
+        if self.dirty:
+            try:
+                await self.write_snapshots()
+            except Exception as e:
+                print(f"Error saving music queues: {e!r}")
+
+    # Restore the guild's saved queue the first time it uses music
+    async def cog_before_invoke(self, ctx):
+        if ctx.guild is None or ctx.guild.id in self.restored:
+            return
+        self.restored.add(ctx.guild.id)
+        if ctx.guild.id in self.data:
+            return
+        try:
+            await self.restore_snapshot(ctx)
+        except Exception as e:
+            print(f"Error restoring music queue for {ctx.guild.id}: {e!r}")
+
+    # - Audio telemetry
+
+    # Seconds between event loop lag measurements
+    LOOP_LAG_INTERVAL = 0.5
+
+    async def measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.LOOP_LAG_INTERVAL)
+            lag = loop.time() - start - self.LOOP_LAG_INTERVAL
+            self.loop_lag_last = lag
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+
+    def loop_lag_summary(self):
+        return (
+            f"loop lag {self.loop_lag_last * 1000:.1f}ms"
+            f" (max {self.loop_lag_max * 1000:.1f}ms)"
+        )
+
+    # Periodically logs the timings of guilds that are playing
+    @tasks.loop(seconds=60)
+    async def audio_stats_logger(self):
+        for guild_id, info in self.data.items():
+            stats = info.get("audio_stats")
+            if stats is None or info["current"] is None:
+                continue
+            print(f"Audio stats {guild_id}: {stats.summary()} | {self.loop_lag_summary()}")
+        # Report the max lag per logging period
+        self.loop_lag_max = self.loop_lag_last
+
+    # - Queue snapshots
+    # Changes only mark the guild as dirty. Snapshots are written together
+    # in the background at most once every SNAPSHOT_DELAY seconds.
+
+    def mark_dirty(self, guild_id):
+        self.dirty.add(guild_id)
+        if self.snapshot_task is None or self.snapshot_task.done():
+            self.snapshot_task = asyncio.create_task(
+                self._write_snapshots_later(),
+                name="music_snapshots",
+            )
+
+    # Keeps writing until nothing is dirty, since guilds marked while a write
+    # is in progress see this task running and don't schedule another.
+    async def _write_snapshots_later(self):
+        while self.dirty:
+            await asyncio.sleep(self.SNAPSHOT_DELAY)
+            try:
+                await self.write_snapshots()
+            except Exception as e:
+                # The next change schedules a retry
+                print(f"Error saving music queues: {e!r}")
+                return
+
+    async def write_snapshots(self):
+        dirty, self.dirty = self.dirty, set()
+        try:
+            await self._write_snapshots(dirty)
+        except BaseException:
+            # Write these guilds next time
+            self.dirty |= dirty
+            raise
+
+    async def _write_snapshots(self, dirty):
+        # Copy the state now since the queue can change while encoding
+        states = {}
+        for guild_id in dirty:
+            if (info := self.data.get(guild_id)) is not None:
+                states[guild_id] = {
+                    "queue": list(info["queue"]),
+                    "current": info["current"],
+                    "loop": info["loop"],
+                    "channel_id": info["channel_id"],
+                }
+        def _encode_all():
+            return [
+                (guild_id, _encode_snapshot(state))
+                for guild_id, state in states.items()
+            ]
+        rows = await asyncio.to_thread(_encode_all)
+        removed = [(guild_id,) for guild_id in dirty if guild_id not in states]
+        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+            await db.executemany("INSERT OR REPLACE INTO music_queue (server_id, snapshot) VALUES (?, ?);", rows)
+            await db.executemany("DELETE FROM music_queue WHERE server_id = ?;", removed)
+            await db.commit()
+
+    async def restore_snapshot(self, ctx):
+        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+            async with db.execute("SELECT snapshot FROM music_queue WHERE server_id = ? LIMIT 1;", (ctx.guild.id,)) as cursor:
+                row = await cursor.fetchone()
+        if row is None or ctx.guild.id in self.data:
+            return
+        state = await asyncio.to_thread(_decode_snapshot, row[0])
+        info = self.get_info(ctx)
+        info["channel_id"] = state["channel_id"]
+        info["loop"] = state["loop"]
+        # Nothing is playing after a restart, so the song that was playing
+        # goes back to the front of the queue
+        if state["current"] is not None:
+            info["queue"].append(state["current"])
+        info["queue"].extend(state["queue"])
 
     # - Song players
     # Returns a source object and the title of the song
 
     # Finds a file using query. Title is query
-    async def _play_local(self, query):
-        source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(query))
+    async def _play_local(self, query, *, volume=1):
+        source = patched_player.PCMVolumeTransformer(
+            discord.FFmpegPCMAudio(query),
+            volume=volume,
+        )
         return source, query
 
     # Searches various sites using url. Title is data["title"] or url
-    async def _play_stream(self, url):
+    async def _play_stream(self, url, *, volume=1):
         original_url = url
         if url[0] == "<" and url[-1] == ">":
             url = url[1:-1]
-        player, data = await self.player_from_url(url, stream=True)
+        player, data = await self.player_from_url(url, stream=True, volume=volume)
         return player, data.get("title", original_url)
 
     # Converts an Online Sequencer sequence into a sound. Title is url
-    async def _play_os(self, url):
+    async def _play_os(self, url, *, volume=1):
         original_url = url
         if url[0] == "<" and url[-1] == ">":
             url = url[1:-1]
         source = await self._create_os_source(url)
+        source = patched_player.PCMVolumeTransformer(source, volume=volume)
         return source, original_url
 
     # Returns the raw source (calling the function if possible)
-    async def _play_raw(self, source):
+    async def _play_raw(self, source, *, volume=1):
         if callable(source):
             source = source()
         if not isinstance(source, discord.AudioSource):
             source = s.wrap_discord_source(s.chunked(source))
         return source, repr(source)
 
-    # Auto-restart task for the advancer task
-    @tasks.loop(seconds=15)
-    async def advancer(self):
-        if self.advance_task is not None and self.advance_task.done():
-            try:
-                exc = self.advance_task.exception()
-            except asyncio.CancelledError:
-                pass
-            else:
-                print("Exception occured in advancer task:")
-                traceback.print_exception(None, exc, exc.__traceback__)
-            self.advance_task = None
-        if self.advance_task is None:
-            self.advance_task = asyncio.create_task(self.handle_advances(), name="music_advancer")
-
-    # Cancel the advancer task if the monitoring task is getting cancelled
-    # (such as when the cog is getting unloaded)
-    @advancer.after_loop
-    async def on_advancer_cancel(self):
-        if self.advancer.is_being_cancelled():
-            if self.advance_task is not None:
-                self.advance_task.cancel()
-                self.advance_task = None
-
-    # The advancer task loop
-    async def handle_advances(self):
-        while True:
-            item = await self.advance_queue.get()
-            asyncio.create_task(self.handle_advance(item))
+    # Starts the advancer task for the guild if it isn't running
+    def start_advancer(self, guild_id):
+        if guild_id not in self.advance_events:
+            self.advance_events[guild_id] = asyncio.Event()
+        task = self.advancers.get(guild_id)
+        if task is not None and not task.done():
+            self.advance_events[guild_id].set()
+            return
+        runner = self.guild_advancer(guild_id)
+        self.advancers[guild_id] = task = asyncio.create_task(
+            runner,
+            name=f"music_advancer_{guild_id}",
+        )
+        # Log uncaught errors
+        def _on_advancer_done(task):
+            if self.advancers.get(guild_id) is task:
+                del self.advancers[guild_id]
+            if task.cancelled():
+                return
+            if not (exc := task.exception()):
+                return
+            print(f"Exception occured in advancer task for {guild_id}:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+        task.add_done_callback(_on_advancer_done)
+
+    # Cancels the advancer task for the guild. Skips cancelling if called
+    # from the advancer itself (it stops once the guild's info is removed).
+    def stop_advancer(self, guild_id):
+        self.advance_events.pop(guild_id, None)
+        task = self.advancers.pop(guild_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    # The advancer task loop for a single guild. Advances are handled one at
+    # a time so there's no need to check if one is already being processed.
+    async def guild_advancer(self, guild_id):
+        while (info := self.data.get(guild_id)) is not None:
+            pending = info["pending"]
+            if not pending:
+                event = self.advance_events.get(guild_id)
+                if event is None:
+                    return
+                event.clear()
+                await event.wait()
+                continue
+            await self.handle_advance(pending.popleft())
 
     # The actual music advancing logic
     async def handle_advance(self, item):
@@ -163,13 +568,6 @@ class Music(commands.Cog):
         info = self.get_info(ctx)
         channel = ctx.guild.get_channel(info["channel_id"])
         try:
-            # If we are processing it right now...
-            if info["processing"]:
-                # Wait a bit and reschedule it again
-                await asyncio.sleep(1)
-                self.advance_queue.put_nowait(item)
-                return
-            info["processing"] = True
             # If there's an error, send it to the channel
             if error is not None:
                 await channel.send(f"Player error: {error!r}")
@@ -183,14 +581,25 @@ class Music(commands.Cog):
             if info["loop"] and info["current"] is not None:
                 queue.append(info["current"])
             info["current"] = None
+            self.mark_dirty(ctx.guild.id)
             if queue:
                 # Get the next song
                 current = queue.popleft()
                 info["current"] = current
-                # Get an audio source and play it
-                after = lambda error, ctx=ctx: self.schedule(ctx, error)
+                # Get an audio source and play it. The callback runs in the
+                # player's thread so we hop back onto the event loop.
+                loop = asyncio.get_running_loop()
+                after = lambda error, ctx=ctx: loop.call_soon_threadsafe(
+                    self.schedule, ctx, error,
+                )
                 async with channel.typing():
-                    source, title = await getattr(self, f"_play_{current['ty']}")(current['query'])
+                    play = getattr(self, f"_play_{current['ty']}")
+                    source, title = await play(current['query'], volume=info["volume"])
+                    # Keep track of timings and CPU usage for Opus and PCM
+                    # sources
+                    mode = "opus" if source.is_opus() else "pcm"
+                    stats = info["audio_stats"] = _AudioStats(mode)
+                    source = _MeteredSource(source, stats, info["cpu"][mode])
                     ctx.voice_client.play(source, after=after)
                 await channel.send(f"Now playing: {title}")
             else:
@@ -202,39 +611,62 @@ class Music(commands.Cog):
             self.schedule(ctx)
         finally:
             info["waiting"] = False
-            info["processing"] = False
 
     # Schedules advancement of the queue
     def schedule(self, ctx, error=None, *, force=False):
         info = self.get_info(ctx)
         if force or not info["waiting"]:
-            self.advance_queue.put_nowait((ctx, error))
+            info["pending"].append((ctx, error))
             info["waiting"] = True
+            self.start_advancer(ctx.guild.id)
 
     # Helper function to create the info for a guild
     def get_info(self, ctx):
         guild_id = ctx.guild.id
         if guild_id not in self.data:
             wrapped = self.data[guild_id] = {}
-            wrapped["queue"] = deque()
+            wrapped["queue"] = IndexedQueue()
             wrapped["current"] = None
             wrapped["waiting"] = False
             wrapped["loop"] = False
-            wrapped["processing"] = False
             wrapped["version"] = 3
         else:
             wrapped = self.data[guild_id]
         if wrapped["version"] == 3:
             wrapped["channel_id"] = ctx.channel.id
             wrapped["version"] = 4
+        if wrapped["version"] == 4:
+            # Advances are now queued per guild
+            wrapped.pop("processing", None)
+            wrapped["pending"] = deque()
+            wrapped["version"] = 5
+        if wrapped["version"] == 5:
+            # Queues support fast indexing for long playlists
+            wrapped["queue"] = IndexedQueue(wrapped["queue"])
+            wrapped["version"] = 6
+        if wrapped["version"] == 6:
+            # Volume is kept between songs so we know when Opus sources can
+            # be passed through without decoding
+            wrapped["volume"] = 1
+            wrapped["cpu"] = {"opus": [0.0, 0], "pcm": [0.0, 0]}
+            wrapped["version"] = 7
+        if wrapped["version"] == 7:
+            # Timings for the song that's currently playing
+            wrapped["audio_stats"] = None
+            wrapped["version"] = 8
         return wrapped
 
     # Helper function to remove the info for a guild
     def pop_info(self, ctx):
         return self.data.pop(ctx.guild.id, None)
 
-    # Creates an audio source from a url
-    async def player_from_url(self, url, *, loop=None, stream=False):
+    # Creates an audio source from a url. At 100% volume, the audio is sent as
+    # Opus straight from FFmpeg (copied if the source is already Opus) so the
+    # player thread doesn't need to scale and encode it. Otherwise the volume
+    # is applied in the player thread, or by FFmpeg if volume_filter is set.
+    # If there are audio nodes, all of this happens in one of them instead
+    # (nodes only play streams with the default FFmpeg options).
+    async def player_from_url(self, url, *, loop=None, stream=False, volume=1):
         ytdl = youtube_dl.YoutubeDL(self.ytdl_opts)
         loop = loop or asyncio.get_running_loop()
         data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
@@ -242,10 +674,70 @@ class Music(commands.Cog):
             # take first item from a playlist
             data = data['entries'][0]
         filename = data['url'] if stream else ytdl.prepare_filename(data)
-        audio = patched_player.FFmpegPCMAudio(filename, **self.ffmpeg_opts)
-        player = discord.PCMVolumeTransformer(audio)
+        if self.audio_nodes and stream and self.ffmpeg_opts == audio_node.FFMPEG_OPTIONS:
+            codec = patched_player.opus_codec(data.get("acodec"))
+            player = await self._player_from_node(filename, volume=volume, codec=codec)
+            if player is not None:
+                return player, data
+        if volume != 1 and self.volume_filter:
+            # Let FFmpeg apply the volume while encoding
+            options = f"{self.ffmpeg_opts.get('options', '')} -af volume={volume:.4f}"
+            ffmpeg_opts = self.ffmpeg_opts | {"options": options.strip()}
+            player = patched_player.FFmpegOpusAudio(filename, **ffmpeg_opts)
+        elif volume != 1:
+            audio = patched_player.FFmpegPCMAudio(filename, **self.ffmpeg_opts)
+            player = patched_player.PCMVolumeTransformer(audio, volume=volume)
+        elif data.get("acodec") not in (None, "none"):
+            # The extractor already knows the codec so we don't need to probe
+            codec = patched_player.opus_codec(data["acodec"])
+            player = patched_player.FFmpegOpusAudio(filename, codec=codec, **self.ffmpeg_opts)
+        else:
+            player = await patched_player.FFmpegOpusAudio.from_probe(filename, **self.ffmpeg_opts)
         return player, data
 
+    # Connects to the audio node playing the fewest sources. Nodes that can't
+    # be reached are skipped for AUDIO_NODE_RETRY seconds and the next one is
+    # tried. Returns None if no node could play it, so it's played in this
+    # process instead.
+    async def _player_from_node(self, filename, *, volume=1, codec=None):
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        addresses = sorted(
+            (
+                address for address in self.audio_nodes
+                if self.audio_node_down.get(address, 0) <= now
+            ),
+            key=self.audio_node_load.__getitem__,
+        )
+        for address in addresses:
+            self.audio_node_load[address] += 1
+            def _release(address=address):
+                if address in self.audio_node_load:
+                    self.audio_node_load[address] -= 1
+            try:
+                return await asyncio.to_thread(
+                    audio_node.NodeAudio.connect,
+                    address,
+                    filename,
+                    volume=volume,
+                    codec=codec,
+                    # Cleanup happens in the player's thread
+                    on_cleanup=lambda: loop.call_soon_threadsafe(_release),
+                )
+            except OSError as e:
+                _release()
+                self.audio_node_down[address] = time.monotonic() + self.AUDIO_NODE_RETRY
+                print(f"Audio node {address[0]}:{address[1]} is down: {e!r}")
+            except discord.ClientException as e:
+                # The node is up but couldn't make the source
+                _release()
+                print(f"Audio node {address[0]}:{address[1]} error: {e}")
+                return None
+            except BaseException:
+                _release()
+                raise
+        return None
+
     # Creates an audio source from an Online Sequencer url
     async def _create_os_source(self, url):
         # Verify that the url is valid
@@ -253,9 +745,24 @@ class Music(commands.Cog):
             id_ = int(url[len(self.ONLINE_SEQUENCER_URL_PREFIX):])
         else:
             id_ = int(url)
-        # Create the url and get note infos
-        url = f"{self.ONLINE_SEQUENCER_URL_PREFIX}{id_}"
-        note_infos = await os_note_infos.get_note_infos_stream(url)
+        cache = self.os_cache
+        note_infos = None
+        save_notes = False
+        if cache is not None:
+            key = await asyncio.to_thread(cache.key, id_)
+            # Play the rendered song straight from the cache if it's there
+            path = cache.get_audio(key)
+            if path is not None:
+                return s.wrap_discord_source(os_cache.read_audio_frames(path))
+            note_infos = await asyncio.to_thread(cache.get_notes, key)
+            save_notes = note_infos is None
+        if note_infos is None:
+            # Create the url and get note infos
+            url = f"{self.ONLINE_SEQUENCER_URL_PREFIX}{id_}"
+            note_infos = await os_note_infos.get_note_infos_stream(
+                url,
+                client=self.bot.http_client,
+            )
         # Start another process to convert these into a sound
         executable, *args = shlex.split(self.os_python_executable)
         process = await asyncio.to_thread(
@@ -264,107 +771,85 @@ class Music(commands.Cog):
                 "online_sequencer_make_chunks.py",
                 "--settings", f"{self.os_directory}/settings.json",
                 "--template", f"{self.os_directory}/<>.ogg",
+                "--format", self.os_note_format,
+                "--workers", str(self.os_render_workers),
+                "--voices", str(self.os_max_voices),
                 executable=executable,
                 pipe_stdin=True,
                 pipe_stdout=True,
             )
         )
         # Start a background task to send in note infos through stdin
-        asyncio.create_task(asyncio.to_thread(
-            lambda: (
-                process.stdin.write(b"["),
-                [
-                    None
-                    for i, note_info in enumerate(note_infos)
-                    if [process.stdin.write(b",") if i != 0 else None]
-                    if [process.stdin.write(json.dumps(note_info).encode())]
-                    if False
-                ],
-                process.stdin.write(b"]"),
-                process.stdin.close(),
-            )
-        ))
-        # Make a small buffer to make audio more consistent
-        chunks_queue = queue.Queue(maxsize=64)
-        stop = False  # Flag for producer to stop
-        producer_event = threading.Event()  # Notifies producer to continue
-        # The sound producer / loader (moves sound from process to the queue)
-        def producer():
+        if self.os_note_format == "binary":
+            write_note_infos = note_stream.write_note_infos
+        else:
+            write_note_infos = note_stream.write_note_infos_json
+        def _write_note_infos():
+            if not save_notes:
+                write_note_infos(process.stdin.write, note_infos)
+                process.stdin.close()
+                return
+            # Keep the parsed notes to save them once they're all sent
+            saved = []
+            def _saving(note_infos):
+                for note_info in note_infos:
+                    saved.append(note_info)
+                    yield note_info
+            write_note_infos(process.stdin.write, _saving(note_infos))
+            process.stdin.close()
+            cache.put_notes(key, saved)
+        asyncio.create_task(asyncio.to_thread(_write_note_infos))
+        # Buffer the rendered audio. How much is buffered before playing
+        # depends on how fast the process renders.
+        buffer = JitterBuffer()
+        # Save the rendered audio as it's loaded (only kept if the whole
+        # song renders successfully)
+        writer = None
+        if cache is not None:
+            writer = await asyncio.to_thread(cache.open_audio, key)
+        # The sound loader (moves sound from the process into the buffer)
+        def load():
+            if writer is None:
+                buffer.fill_from(process.stdout.readinto)
+                return
+            def readinto(view):
+                count = process.stdout.readinto(view)
+                if count:
+                    writer.write(view[:count])
+                return count
             try:
-                # Loop over chunks of the process's stdout
-                for chunk in s.equal_chunk_stream(
-                    s.chunked_ffmpeg_process(process),
-                    3840,
-                ):
-                    chunk = bytes(chunk)
-                    while True:
-                        # Check if we need to stop
-                        if stop:
-                            return
-                        # Clear the event before we try getting an item just in
-                        # case of bad timing (event gets cleared just after we
-                        # try putting an item).
-                        producer_event.clear()
-                        try:
-                            # Try putting the chunk
-                            chunks_queue.put(chunk, block=False)
-                        except queue.Full:
-                            # Wait for the event to be set
-                            cleared = producer_event.wait(timeout=5)
-                            # If the event isn't set after 5 seconds...
-                            if not cleared:
-                                # Assume our audio player is too slow and error
-                                raise RuntimeError("Sound player too slow")
-                        else:
-                            # If all went well, go process the next chunk
-                            break
-            except BaseException as e:
-                # Let the consumer know we errored
-                chunks_queue.put(e, timeout=5)
+                if buffer.fill_from(readinto) and process.wait() == 0:
+                    writer.commit()
             finally:
-                # Let the consumer know we ended
-                chunks_queue.put(None, timeout=5)
-        # Make a thread for the producer
-        task = asyncio.create_task(asyncio.to_thread(lambda: producer()))
-        # Ignore exceptions (kinda like a daemon task)
+                writer.abort()
+        task = asyncio.create_task(asyncio.to_thread(load))
+        # Ignore exceptions (the buffer passes them on to the consumer)
         task.add_done_callback(lambda task: task.exception())
-        # The sound consumer / player (yields from queue to the audio source)
+        # Stops the loader and the process
+        def close():
+            # Tell the loader to stop if it's still running
+            buffer.stop()
+            # Terminate the process (this also ends any blocked reads)
+            process.terminate()
+            process.wait()
+            process.stdout.close()
+            process.stdin.close()
+        # The sound consumer / player (yields frames from the buffer)
         def consumer():
             try:
-                # Loop until we have no more chunks to process
-                while True:
-                    try:
-                        # Try getting an item
-                        item = chunks_queue.get(timeout=5)
-                    except queue.Empty:
-                        # If we needed to wait more than 5 seconds, assume the
-                        # loader is too slow and tell it to stop
-                        raise RuntimeError("Sound loader too slow")
-                    else:
-                        # Tell the producer it can put more items
-                        producer_event.set()
-                    # If the producer has ended, we should end too
-                    if item is None:
-                        return
-                    # If the producer errored, reraise it here
-                    if isinstance(item, BaseException):
-                        raise item
-                    # Otherwise, it's just a normal chunk of audio. Yield it
-                    yield item
+                while (frame := buffer.read()) is not None:
+                    yield frame
             finally:
-                # Tell the producer to stop if it's still running
-                nonlocal stop
-                stop = True
-                producer_event.set()
-                # Terminate the process
-                process.stdout.close()
-                process.stdin.close()
-                process.terminate()
-                process.wait()
-        # Wrap the sound player chunk iterator with an audio source
+                close()
+        # Wrap the sound player frame iterator with an audio source
         source = s.wrap_discord_source(consumer())
-        # Wait a lil bit to get the chunk queue prefilled
-        await asyncio.sleep(2)
+        source.buffer_fill = buffer.fill
+        source.buffer_underruns = lambda: buffer.underruns
+        # Wait until enough is buffered to start playing smoothly
+        ready = await asyncio.to_thread(buffer.wait_ready, self.OS_START_TIMEOUT)
+        if not ready:
+            await asyncio.to_thread(close)
+            raise RuntimeError("Sound loader didn't start")
         # Return the audio source
         return source
 
@@ -385,127 +870,241 @@ class Music(commands.Cog):
         info = self.get_info(ctx)
         if info["channel_id"] != ctx.channel.id:
             info["channel_id"] = ctx.channel.id
+            self.mark_dirty(ctx.guild.id)
             await ctx.send("Switching music output to this channel")
+        # Start playing a queue restored from a snapshot
+        if info["queue"] and info["current"] is None:
+            self.schedule(ctx)
 
     @commands.command()
     @commands.is_owner()
     async def local(self, ctx, *, query):
         """Plays a file from the local filesystem"""
-        info = self.get_info(ctx)
-        queue = info["queue"]
-        queue.append({"ty": "local", "query": query})
-        if info["current"] is None:
-            self.schedule(ctx)
+        self.enqueue(ctx, [{"ty": "local", "query": query}])
         await ctx.send(f"Added to queue: local {query}")
 
     @commands.command(aliases=["yt", "play", "p"])
     async def stream(self, ctx, *, url):
         """Plays from a url (almost anything youtube_dl supports)"""
-        if len(url) > 100:
-            raise ValueError("url too long (length over 100)")
-        if not url.isprintable():
-            raise ValueError(f"url not printable: {url!r}")
+        self.check_url(url)
         print(ctx.message.author.name, "queued", repr(url))
-        info = self.get_info(ctx)
-        queue = info["queue"]
-        ty = "local" if url == "coco.mp4" else "stream"
-        queue.append({"ty": ty, "query": url})
-        if info["current"] is None:
-            self.schedule(ctx)
-        await ctx.send(f"Added to queue: {ty} {url}")
+        song = self.song_from_url(url)
+        self.enqueue(ctx, [song])
+        await ctx.send(f"Added to queue: {song['ty']} {url}")
 
     if has_os:
         @commands.command(name="_play_os")
         async def play_os(self, ctx, *, url):
             """Plays an Online Sequencer sequence"""
-            if len(url) > 100:
-                raise ValueError("url too long (length over 100)")
-            if not url.isprintable():
-                raise ValueError(f"url not printable: {url!r}")
+            self.check_url(url)
             print(ctx.message.author.name, "queued", repr(url))
-            info = self.get_info(ctx)
-            queue = info["queue"]
-            queue.append({"ty": "os", "query": url})
+            self.enqueue(ctx, [{"ty": "os", "query": url}])
+            await ctx.send(f"Added to queue: os {url}")
+
+        @commands.command(name="oscache")
+        async def os_cache_stats(self, ctx):
+            """Shows the Online Sequencer cache's size and hit rates"""
+            if self.os_cache is None:
+                await ctx.send("The Online Sequencer cache is off")
+                return
+            stats = await asyncio.to_thread(self.os_cache.stats)
+            lines = []
+            for name, tier in stats.items():
+                lines.append(
+                    f"{name}: {tier['entries']} entries,"
+                    f" {tier['bytes'] / 2**20:.1f}/{tier['max_bytes'] / 2**20:.0f}MB,"
+                    f" {tier['hits']} hits, {tier['misses']} misses,"
+                    f" {tier['evictions']} evictions"
+                )
+            await ctx.send("\n".join(lines))
+
+    # Raises ValueError if the url shouldn't be queued
+    @staticmethod
+    def check_url(url):
+        if len(url) > 100:
+            raise ValueError("url too long (length over 100)")
+        if not url.isprintable():
+            raise ValueError(f"url not printable: {url!r}")
+
+    # Returns the queue entry for a url passed to %stream
+    @staticmethod
+    def song_from_url(url):
+        ty = "local" if url == "coco.mp4" else "stream"
+        return {"ty": ty, "query": url}
+
+    def enqueue(self, ctx, songs):
+        """Adds songs to the end of the queue in one go
+
+        The guild is scheduled once if nothing is playing. Returns the number
+        of songs added.
+
+        """
+        info = self.get_info(ctx)
+        queue = info["queue"]
+        length = len(queue)
+        queue.extend(songs)
+        if len(queue) != length:
+            self.mark_dirty(ctx.guild.id)
             if info["current"] is None:
                 self.schedule(ctx)
-            await ctx.send(f"Added to queue: os {url}")
+        return len(queue) - length
 
-    async def add_to_queue(self, ctx, source):
-        """Plays the specified source"""
+    async def add_to_queue(self, ctx, *sources):
+        """Plays the specified sources"""
         if ctx.voice_client is None:
             if ctx.author.voice:
                 await ctx.author.voice.channel.connect()
             else:
                 raise RuntimeError("Author not connected to a voice channel")
-        info = self.get_info(ctx)
-        queue = info["queue"]
-        queue.append({"ty": "raw", "query": source})
-        if info["current"] is None:
-            self.schedule(ctx)
+        self.enqueue(ctx, [{"ty": "raw", "query": source} for source in sources])
+
+    # Returns a url that can be streamed for a flat playlist entry
+    @staticmethod
+    def _playlist_entry_url(entry):
+        url = entry.get("url") or entry.get("webpage_url")
+        if url is None:
+            return None
+        if "://" not in url and entry.get("ie_key", "Youtube") == "Youtube":
+            # Older extractors only give the video id
+            url = f"https://www.youtube.com/watch?v={url}"
+        return url
+
+    # Yields the entries of a playlist as they are extracted. Runs in a thread
+    # since the extractor fetches pages of the playlist lazily.
+    def _iter_playlist_entries(self, ytdl, url):
+        data = ytdl.extract_info(url, download=False, process=False)
+        # Follow redirects to the actual playlist (like watch?v=...&list=...)
+        for _ in range(5):
+            if data.get("_type") not in ("url", "url_transparent"):
+                break
+            data = ytdl.extract_info(
+                data["url"],
+                download=False,
+                ie_key=data.get("ie_key"),
+                process=False,
+            )
+        if 'entries' not in data:
+            raise ValueError("cannot find entries of playlist")
+        entries = data['entries']
+        if hasattr(entries, "getslice"):
+            # Paged lists only load the pages that are sliced
+            start = 0
+            while page := entries.getslice(start, start + self.PLAYLIST_BATCH_SIZE):
+                yield from page
+                start += len(page)
+        else:
+            yield from entries
 
     @commands.command()
     async def _add_playlist(self, ctx, *, url):
-        """Adds all songs in a playlist to the queue"""
-        if len(url) > 100:
-            raise ValueError("url too long (length over 100)")
-        if not url.isprintable():
-            raise ValueError(f"url not printable: {url!r}")
+        """Adds all songs in a playlist to the queue
+
+        The first song is queued as soon as it is found and the rest are added
+        in batches as the playlist loads.
+
+        """
+        self.check_url(url)
         print(ctx.message.author.name, "queued playlist", repr(url))
+        original_url = url
         bracketed = False
         if url[0] == "<" and url[-1] == ">":
             bracketed = True
             url = url[1:-1]
         info = self.get_info(ctx)
-        queue = info["queue"]
         ytdl = youtube_dl.YoutubeDL(self.ytdl_opts | {
             'noplaylist': None,
             'playlistend': None,
             "extract_flat": True,
         })
-        data = await asyncio.to_thread(ytdl.extract_info, url, download=False)
-        if 'entries' not in data:
-            raise ValueError("cannot find entries of playlist")
-        entries = data['entries']
-        for entry in entries:
-            url = f"https://www.youtube.com/watch?v={entry['url']}"
-            if bracketed:
-                url = f"<{url}>"
-            queue.append({"ty": "stream", "query": url})
-        if info["current"] is None:
-            self.schedule(ctx)
-        await ctx.send(f"Added playlist to queue: {url}")
+        # Batches of urls are passed from the extractor thread to here
+        loop = asyncio.get_running_loop()
+        batches = asyncio.Queue()
+        stop = False  # Flag for the extractor to stop
+        def producer():
+            try:
+                batch = []
+                last_sent = 0
+                for entry in self._iter_playlist_entries(ytdl, url):
+                    if stop:
+                        return
+                    entry_url = self._playlist_entry_url(entry)
+                    if entry_url is None:
+                        continue
+                    if bracketed:
+                        entry_url = f"<{entry_url}>"
+                    batch.append(entry_url)
+                    # Send the first entry right away so it can start playing
+                    now = time.monotonic()
+                    if (
+                        last_sent == 0
+                        or len(batch) >= self.PLAYLIST_BATCH_SIZE
+                        or now - last_sent >= 1
+                    ):
+                        loop.call_soon_threadsafe(batches.put_nowait, batch)
+                        batch = []
+                        last_sent = now
+                if batch:
+                    loop.call_soon_threadsafe(batches.put_nowait, batch)
+            except BaseException as e:
+                loop.call_soon_threadsafe(batches.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(batches.put_nowait, None)
+        task = asyncio.create_task(asyncio.to_thread(producer))
+        # Ignore exceptions (they're passed through the batches queue)
+        task.add_done_callback(lambda task: task.exception())
+        count = 0
+        try:
+            while (batch := await batches.get()) is not None:
+                if isinstance(batch, BaseException):
+                    raise batch
+                # Stop if the queue was cleared by %leave
+                if self.data.get(ctx.guild.id) is not info:
+                    return
+                count += self.enqueue(ctx, [
+                    {"ty": "stream", "query": entry_url}
+                    for entry_url in batch
+                ])
+        finally:
+            stop = True
+        await ctx.send(f"Added playlist to queue ({count} songs): {original_url}")
 
     @commands.command(name="batch_add")
     async def _batch_add(self, ctx, *, urls):
         """Plays from multiple urls split by lines"""
-        for url in urls.splitlines():
-            await self.stream(ctx, url=url)
-            await asyncio.sleep(0.1)
+        urls = [url for url in map(str.strip, urls.splitlines()) if url]
+        # Check every url before queuing any of them
+        for i, url in enumerate(urls, start=1):
+            try:
+                self.check_url(url)
+            except ValueError as e:
+                raise commands.CommandError(f"Invalid url [{i}]: {e}")
+        print(ctx.message.author.name, "queued", len(urls), "urls")
+        count = self.enqueue(ctx, map(self.song_from_url, urls))
+        await ctx.send(f"Added {count} songs to queue")
 
     @commands.command()
     async def shuffle(self, ctx):
         """Shuffles the queue"""
         info = self.get_info(ctx)
-        queue = info["queue"]
-        temp = []
-        while queue:
-            temp.append(queue.popleft())
-        random.shuffle(temp)
-        while temp:
-            queue.appendleft(temp.pop())
+        info["queue"].shuffle()
+        self.mark_dirty(ctx.guild.id)
         await ctx.send("Queue shuffled")
 
     @commands.command()
     async def volume(self, ctx, volume: float = None):
-        """Gets or changes the player's volume"""
+        """Gets or changes the player's volume
+
+        Songs played at 100% volume skip decoding when possible, so changing
+        the volume of one of them only takes effect from the next song.
+
+        """
+        info = self.get_info(ctx)
         if volume is None:
-            volume = ctx.voice_client.source.volume * 100
+            volume = info["volume"] * 100
             if int(volume) == volume:
                 volume = int(volume)
             await ctx.send(f"Volume set to {volume}%")
             return
-        if ctx.voice_client is None:
-            return await ctx.send("Not connected to a voice channel")
         try:
             if int(volume) == volume:
                 volume = int(volume)
@@ -514,8 +1113,61 @@ class Music(commands.Cog):
         if not await self.bot.is_owner(ctx.author):
             # prevent insane ppl from doing this
             volume = min(100, volume)
-        ctx.voice_client.source.volume = volume / 100
-        await ctx.send(f"Changed volume to {volume}%")
+        info["volume"] = volume / 100
+        source = ctx.voice_client.source
+        source = getattr(source, "source", source)  # Unwrap _MeteredSource
+        if (
+            source is None
+            or isinstance(source, discord.PCMVolumeTransformer)
+            or getattr(source, "supports_volume", False)  # Audio nodes
+        ):
+            if source is not None:
+                source.volume = volume / 100
+            await ctx.send(f"Changed volume to {volume}%")
+        else:
+            await ctx.send(f"Changed volume to {volume}% (from the next song)")
+
+    @commands.command()
+    async def audiostats(self, ctx):
+        """Shows timings of the audio pipeline for the current song
+
+        Read times are how long the source took to give each 20ms frame
+        (including volume scaling), and encode times are the player's CPU time
+        for encoding and sending it. Underruns are reads slower than a frame, or times an Online
+        Sequencer song's buffer ran dry. Loop lag is how late the bot's event
+        loop is running.
+
+        """
+        info = self.get_info(ctx)
+        stats = info["audio_stats"]
+        if stats is None or info["current"] is None:
+            summary = "Not playing anything right now"
+        else:
+            summary = stats.summary()
+        await ctx.send(f"{summary} | {self.loop_lag_summary()}")
+
+    @commands.command(name="playercpu")
+    async def player_cpu(self, ctx):
+        """Shows the player's CPU usage for Opus and PCM songs
+
+        Only the bot's player thread is counted (reading, volume scaling,
+        encoding and sending). FFmpeg runs in its own process, so its decoding
+        (and its Opus encoding for Opus songs) isn't included.
+
+        """
+        info = self.get_info(ctx)
+        lines = []
+        for mode, (seconds, frames) in info["cpu"].items():
+            if not frames:
+                lines.append(f"{mode}: no frames played")
+                continue
+            audio_seconds = frames * 0.02  # Each frame is 20ms
+            lines.append(
+                f"{mode}: {seconds / audio_seconds * 1000:.2f}ms CPU per"
+                f" second of audio ({audio_seconds:.0f}s played)"
+            )
+        lines.append("(player thread only, FFmpeg's CPU isn't counted)")
+        await ctx.send("\n".join(lines))
 
     @commands.command(aliases=["stop"])
     async def pause(self, ctx):
@@ -531,6 +1183,8 @@ class Music(commands.Cog):
     async def leave(self, ctx):
         """Disconnects the bot from voice and clears the queue"""
         self.pop_info(ctx)
+        self.stop_advancer(ctx.guild.id)
+        self.mark_dirty(ctx.guild.id)
         if ctx.voice_client is None:
             return
         await ctx.voice_client.disconnect()
@@ -547,8 +1201,12 @@ class Music(commands.Cog):
         await ctx.send(f"Current: {query}")
 
     @commands.command(aliases=["q"])
-    async def queue(self, ctx):
-        """Shows the songs on queue"""
+    async def queue(self, ctx, page: int = 1):
+        """Shows a page of the songs on queue
+
+        Negative pages count from the end, so %queue -1 shows the last page.
+
+        """
         queue = ()
         length = 0
         looping = False
@@ -557,14 +1215,23 @@ class Music(commands.Cog):
             queue = info["queue"]
             length = len(queue)
             looping = info["loop"]
-        if not queue:
-            queue = (None,)
+        page_size = self.QUEUE_PAGE_SIZE
+        page_count = max(1, -(-length // page_size))
+        try:
+            page_index = self.normalize_index(ctx, page, page_count)
+        except ValueError:
+            raise commands.CommandError(f"Page out of range [{page}]")
+        start = page_index * page_size
         paginator = commands.Paginator()
-        paginator.add_line(f"Queue [{length}]{' (looping)'*looping}:")
-        for i, song in enumerate(queue, start=1):
-            if song is None:
-                paginator.add_line("None")
-            else:
+        paginator.add_line(
+            f"Queue [{length}]{' (looping)'*looping}"
+            f" page {page_index + 1}/{page_count}:"
+        )
+        if not queue:
+            paginator.add_line("None")
+        else:
+            songs = queue.islice(start, start + page_size)
+            for i, song in enumerate(songs, start=start + 1):
                 paginator.add_line(f"{i}: {song['query']}")
         for page in paginator.pages:
             await ctx.send(page)
@@ -580,18 +1247,32 @@ class Music(commands.Cog):
         return index
 
     @commands.command()
-    async def remove(self, ctx, position: int):
-        """Removes a song on queue"""
+    async def remove(self, ctx, position: int, end: typing.Optional[int] = None):
+        """Removes a song on queue
+
+        If end is given, all songs from position to end (inclusive) are
+        removed.
+
+        """
         info = self.get_info(ctx)
         queue = info["queue"]
         try:
             index = self.normalize_index(ctx, position, len(queue))
         except ValueError:
             raise commands.CommandError(f"Index out of range [{position}]")
-        queue.rotate(-index)
-        song = queue.popleft()
-        queue.rotate(index)
-        await ctx.send(f"Removed song [{position}]: {song['query']}")
+        self.mark_dirty(ctx.guild.id)
+        if end is None:
+            song = queue.pop(index)
+            await ctx.send(f"Removed song [{position}]: {song['query']}")
+            return
+        try:
+            end_index = self.normalize_index(ctx, end, len(queue))
+        except ValueError:
+            raise commands.CommandError(f"End index out of range [{end}]")
+        if end_index < index:
+            raise commands.CommandError(f"End before start [{position} > {end}]")
+        songs = queue.remove_range(index, end_index + 1)
+        await ctx.send(f"Removed {len(songs)} songs [{position} -> {end}]")
 
     @commands.command()
     async def move(self, ctx, origin: int, target: int):
@@ -606,11 +1287,8 @@ class Music(commands.Cog):
             target_index = self.normalize_index(ctx, target, len(queue))
         except ValueError:
             raise commands.CommandError(f"Target index out of range [{target}]")
-        queue.rotate(-origin_index)
-        song = queue.popleft()
-        queue.rotate(origin_index - target_index)
-        queue.appendleft(song)
-        queue.rotate(target_index)
+        song = queue.move(origin_index, target_index)
+        self.mark_dirty(ctx.guild.id)
         await ctx.send(f"Moved song [{origin} -> {target}]: {song['query']}")
 
     @commands.command()
@@ -619,6 +1297,7 @@ class Music(commands.Cog):
         info = self.get_info(ctx)
         queue = info["queue"]
         queue.clear()
+        self.mark_dirty(ctx.guild.id)
         await ctx.send("Cleared queue")
 
     @commands.command(aliases=["s"])
@@ -638,17 +1317,19 @@ class Music(commands.Cog):
             await ctx.send(f"Queue {'is' if info['loop'] else 'is not'} looping")
             return
         info["loop"] = loop
+        self.mark_dirty(ctx.guild.id)
         await ctx.send(f"Queue {'is now' if info['loop'] else 'is now not'} looping")
 
     @commands.command()
     @commands.is_owner()
     async def reschedule(self, ctx):
-        """Reschedules the current guild onto the advancer task"""
+        """Reschedules the current guild onto its advancer task"""
         self.schedule(ctx, force=True)
         await ctx.send("Rescheduled")
 
     @local.before_invoke
     @stream.before_invoke
+    @_batch_add.before_invoke
     async def ensure_connected(self, ctx):
         if ctx.voice_client is None:
             if ctx.author.voice:
@@ -1,4 +1,3 @@
-import aiohttp
 from discord.ext import commands
 
 class YesNo(commands.Cog):
@@ -12,10 +11,12 @@ class YesNo(commands.Cog):
         Uses https://www.yesno.wtf/api to get a GIF.
 
         """
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://yesno.wtf/api") as response:
-                data = await response.json()
-                await ctx.send(f"{data['answer']} lol: {data['image']}")
+        response = await self.bot.http_client.get("https://yesno.wtf/api")
+        if response.status != 200:
+            await ctx.send(f"Couldn't get an answer (HTTP {response.status})")
+            return
+        data = response.json()
+        await ctx.send(f"{data['answer']} lol: {data['image']}")
 
 def setup(bot):
     return bot.add_cog(YesNo(bot))
@@ -0,0 +1,146 @@
+"""Shared HTTP client for outbound requests
+
+Making a new session per request means a new connection (and TLS handshake)
+every time. One HTTPClient is made per bot (as bot.http_client) and borrowed by
+anything that fetches from the web, so connections are kept alive and pooled.
+
+GET responses with an ETag or Last-Modified header are remembered. The next
+GET to the same url asks the server if it changed, and a 304 Not Modified
+response gets the remembered body back.
+
+This uses aiohttp since discord.py already depends on it. aiohttp only speaks
+HTTP/1.1, so there's no HTTP/2.
+
+Example:
+    client = HTTPClient()
+    try:
+        response = await client.get("https://yesno.wtf/api")
+        data = response.json()
+    finally:
+        await client.close()
+
+"""
+import json
+from collections import OrderedDict
+from typing import Any, Optional
+
+import aiohttp
+
+class Response:
+    """A finished response with its body already read"""
+
+    __slots__ = ("url", "status", "headers", "content", "from_cache")
+
+    def __init__(self, url, status, headers, content, *, from_cache=False):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    def __repr__(self):
+        return f"<{type(self).__name__} [{self.status}] {self.url}>"
+
+    @property
+    def text(self) -> str:
+        _, _, params = self.headers.get("Content-Type", "").partition(";")
+        encoding = "utf-8"
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "charset" and value:
+                encoding = value.strip('"')
+        try:
+            return self.content.decode(encoding, errors="replace")
+        except LookupError:
+            return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+class HTTPClient:
+    """Pooled HTTP client with timeouts and conditional request caching
+
+    The session is made on first use so this can be created outside of a
+    running event loop.
+
+    """
+    def __init__(
+        self,
+        *,
+        timeout: float = 30,
+        connections: int = 32,
+        connections_per_host: int = 8,
+        keepalive_timeout: float = 60,
+        cache_size: int = 64,
+    ):
+        self.timeout = timeout
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.cache_size = cache_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Maps urls to their last cacheable response
+        self._cache: "OrderedDict[str, Response]" = OrderedDict()
+        self.requests = self.revalidated = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connections,
+                limit_per_host=self.connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def get(self, url: str, *, headers: Optional[dict] = None) -> Response:
+        """Sends a GET request and reads the whole response"""
+        headers = dict(headers or {})
+        cached = self._cache.get(url)
+        if cached is not None:
+            if "ETag" in cached.headers:
+                headers.setdefault("If-None-Match", cached.headers["ETag"])
+            if "Last-Modified" in cached.headers:
+                headers.setdefault("If-Modified-Since", cached.headers["Last-Modified"])
+        self.requests += 1
+        async with self.session.get(url, headers=headers) as response:
+            content = await response.read()
+            status = response.status
+            response_headers = response.headers.copy()
+            final_url = str(response.url)
+        if status == 304 and cached is not None:
+            self.revalidated += 1
+            self._cache.move_to_end(url)
+            return Response(
+                final_url,
+                cached.status,
+                cached.headers,
+                cached.content,
+                from_cache=True,
+            )
+        result = Response(final_url, status, response_headers, content)
+        self._remember(url, result)
+        return result
+
+    def _remember(self, url: str, response: Response) -> None:
+        headers = response.headers
+        if response.status != 200 or self.cache_size <= 0:
+            return
+        if "no-store" in headers.get("Cache-Control", ""):
+            return
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            self._cache.pop(url, None)
+            return
+        self._cache[url] = response
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
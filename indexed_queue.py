@@ -0,0 +1,256 @@
+"""Indexable queue for long music queues
+
+A deque is great for popping from the front, but getting, removing or moving
+the Nth item needs O(n) rotations. Music queues made from playlists can be
+thousands of entries long, so this module provides a queue that is split into
+blocks of bounded size. A Fenwick tree over the block lengths finds the block
+holding any index in O(log n), and every change only touches one block (plus
+the tree) unless a block needs to be split or dropped.
+
+Example:
+    >>> queue = IndexedQueue(range(10))
+    >>> queue.popleft()
+    0
+    >>> queue.move(0, -1)
+    1
+    >>> queue[-1], len(queue)
+    (1, 9)
+    >>> del queue[2:5]
+    >>> list(queue)
+    [2, 3, 7, 8, 9, 1]
+    >>> list(queue.islice(1, 3))
+    [3, 7]
+
+"""
+import random
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+class IndexedQueue:
+    """Queue supporting O(log n) indexing, removing and moving of items"""
+
+    __slots__ = ("_blocks", "_tree", "_len", "_load")
+
+    # Blocks are split once they grow past twice this size
+    DEFAULT_LOAD = 256
+
+    def __init__(self, items: Iterable = (), *, load: int = DEFAULT_LOAD):
+        self._load = load
+        self._blocks: List[list] = []
+        self._tree: List[int] = []
+        self._len = 0
+        self.extend(items)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} len={self._len}>"
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        for block in self._blocks:
+            yield from block
+
+    # - Fenwick tree over block lengths
+
+    def _rebuild(self) -> None:
+        tree = [len(block) for block in self._blocks]
+        for i in range(len(tree)):
+            j = i | (i + 1)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _update(self, pos: int, delta: int) -> None:
+        tree = self._tree
+        while pos < len(tree):
+            tree[pos] += delta
+            pos |= pos + 1
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        # Returns the block position and the offset inside that block
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        tree = self._tree
+        pos = 0
+        step = 1 << (len(tree).bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt <= len(tree) and tree[nxt - 1] <= index:
+                index -= tree[nxt - 1]
+                pos = nxt
+            step >>= 1
+        return pos, index
+
+    def _slice_bounds(self, key: slice) -> Tuple[int, int]:
+        start, stop, step = key.indices(self._len)
+        if step != 1:
+            raise ValueError("queue slices must have a step of 1")
+        return start, max(start, stop)
+
+    # - Single item access
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.islice(*self._slice_bounds(index)))
+        pos, offset = self._locate(index)
+        return self._blocks[pos][offset]
+
+    def __setitem__(self, index: int, item: Any) -> None:
+        pos, offset = self._locate(index)
+        self._blocks[pos][offset] = item
+
+    def __delitem__(self, index) -> None:
+        if isinstance(index, slice):
+            self.remove_range(*self._slice_bounds(index))
+        else:
+            self.pop(index)
+
+    def append(self, item: Any) -> None:
+        if not self._blocks:
+            self._blocks.append([item])
+            self._tree.append(1)
+            self._len = 1
+            return
+        self._blocks[-1].append(item)
+        self._len += 1
+        self._update(len(self._blocks) - 1, 1)
+        self._split_if_needed(len(self._blocks) - 1)
+
+    def appendleft(self, item: Any) -> None:
+        self.insert(0, item)
+
+    def insert(self, index: int, item: Any) -> None:
+        if index < 0:
+            index = max(0, index + self._len)
+        if index >= self._len:
+            self.append(item)
+            return
+        pos, offset = self._locate(index)
+        self._blocks[pos].insert(offset, item)
+        self._len += 1
+        self._update(pos, 1)
+        self._split_if_needed(pos)
+
+    def pop(self, index: int = -1) -> Any:
+        pos, offset = self._locate(index)
+        block = self._blocks[pos]
+        item = block.pop(offset)
+        self._len -= 1
+        if block:
+            self._update(pos, -1)
+        else:
+            del self._blocks[pos]
+            self._rebuild()
+        return item
+
+    def popleft(self) -> Any:
+        if not self._len:
+            raise IndexError("pop from an empty queue")
+        return self.pop(0)
+
+    def move(self, origin: int, target: int) -> Any:
+        """Moves the item at origin so that it ends up at target"""
+        if target < 0:
+            target += self._len
+        if not 0 <= target < self._len:
+            raise IndexError("queue index out of range")
+        item = self.pop(origin)
+        self.insert(target, item)
+        return item
+
+    def _split_if_needed(self, pos: int) -> None:
+        block = self._blocks[pos]
+        if len(block) <= 2 * self._load:
+            return
+        self._blocks[pos:pos + 1] = [
+            block[i:i + self._load]
+            for i in range(0, len(block), self._load)
+        ]
+        self._rebuild()
+
+    # - Bulk operations
+
+    def extend(self, items: Iterable) -> None:
+        blocks = self._blocks
+        load = self._load
+        added = 0
+        for item in items:
+            if not blocks or len(blocks[-1]) >= load:
+                blocks.append([])
+            blocks[-1].append(item)
+            added += 1
+        if added:
+            self._len += added
+            self._rebuild()
+
+    def remove_range(self, start: int, stop: int) -> List:
+        """Removes and returns the items in [start, stop)"""
+        if start < 0:
+            start = max(0, start + self._len)
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        first, first_offset = self._locate(start)
+        last, last_offset = self._locate(stop - 1)
+        blocks = self._blocks
+        if first == last:
+            removed = blocks[first][first_offset:last_offset + 1]
+            del blocks[first][first_offset:last_offset + 1]
+        else:
+            removed = blocks[first][first_offset:]
+            for block in blocks[first + 1:last]:
+                removed.extend(block)
+            removed.extend(blocks[last][:last_offset + 1])
+            del blocks[last][:last_offset + 1]
+            del blocks[first][first_offset:]
+            del blocks[first + 1:last]
+        self._blocks = [block for block in blocks if block]
+        self._len -= len(removed)
+        self._rebuild()
+        return removed
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self._tree.clear()
+        self._len = 0
+
+    def islice(self, start: int = 0, stop: Optional[int] = None) -> Iterator:
+        """Lazily yields the items in [start, stop)"""
+        if stop is None or stop > self._len:
+            stop = self._len
+        if start < 0:
+            start = max(0, start + self._len)
+        if start >= stop:
+            return
+        pos, offset = self._locate(start)
+        remaining = stop - start
+        for block in self._blocks[pos:]:
+            chunk = block[offset:offset + remaining]
+            yield from chunk
+            remaining -= len(chunk)
+            if not remaining:
+                return
+            offset = 0
+
+    def shuffle(self, *, rng: random.Random = random) -> None:
+        """Shuffles the items in place without changing the block layout"""
+        blocks = self._blocks
+        n = self._len
+        # Fisher-Yates over (block, offset) pairs. The position of i is
+        # tracked incrementally since it only ever moves backwards.
+        pos = len(blocks) - 1
+        offset = len(blocks[pos]) - 1 if blocks else -1
+        for i in range(n - 1, 0, -1):
+            j = rng.randrange(i + 1)
+            other_pos, other_offset = self._locate(j)
+            block = blocks[pos]
+            other = blocks[other_pos]
+            block[offset], other[other_offset] = (
+                other[other_offset], block[offset],
+            )
+            offset -= 1
+            if offset < 0:
+                pos -= 1
+                offset = len(blocks[pos]) - 1
@@ -0,0 +1,209 @@
+"""Adaptive jitter buffer for rendered audio frames
+
+Sounds rendered on the fly (like Online Sequencer songs) arrive at an uneven
+speed. This buffer sits between a producer thread reading the renderer's
+output and the audio player reading 20ms frames.
+
+Frames live in one preallocated ring buffer. The producer reads straight into
+a free slot and the consumer gets a memoryview of the next slot, so no frame is
+copied or allocated in between. The slot handed out last is kept until the
+next read so it isn't overwritten while being played.
+
+Instead of fixed prefill times and timeouts, the buffer measures how fast the
+producer renders compared to realtime. Playback starts once enough audio for
+that speed is buffered. If the buffer ever runs dry, silence is played while
+it refills to a higher target.
+
+Example:
+    >>> import io
+    >>> buffer = JitterBuffer(frame_size=4, capacity=8)
+    >>> buffer.fill_from(io.BytesIO(b"abcdefghij").readinto)
+    True
+    >>> buffer.wait_ready()
+    True
+    >>> [bytes(frame) for frame in iter(buffer.read, None)]
+    [b'abcd', b'efgh', b'ij\\x00\\x00']
+
+"""
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+class JitterBuffer:
+    """Ring buffer of fixed size frames with an adaptive playback target"""
+
+    def __init__(
+        self,
+        *,
+        frame_size: int = 3840,
+        capacity: int = 256,
+        frame_seconds: float = 0.02,
+        min_target: float = 0.1,
+        max_target: float = 4.0,
+    ):
+        self.frame_size = frame_size
+        self.capacity = capacity
+        self.frame_seconds = frame_seconds
+        self.min_target = min_target
+        self.max_target = max_target
+        self._view = memoryview(bytearray(frame_size * capacity))
+        self._silence = memoryview(bytes(frame_size))
+        self._cond = threading.Condition()
+        self._written = 0  # Total frames written by the producer
+        self._read = 0  # Total frames handed out to the consumer
+        self._closed = False  # Producer has finished
+        self._stopped = False  # Consumer doesn't want more frames
+        self._error: Optional[BaseException] = None
+        self._buffering = True
+        # Lowest target in seconds. Raised after every underrun.
+        self._floor = min_target
+        # Average seconds the producer takes to render a frame
+        self._frame_time: Optional[float] = None
+        self.underruns = 0
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__} buffered={self.buffered}"
+            f" target={self.target_frames} speed={self.speed}>"
+        )
+
+    @property
+    def buffered(self) -> int:
+        return self._written - self._read
+
+    def fill(self) -> float:
+        """Returns how full the buffer is from 0 to 1"""
+        return self.buffered / (self.capacity - 1)
+
+    @property
+    def speed(self) -> Optional[float]:
+        """Render speed as a multiple of realtime (None if unknown)"""
+        if self._frame_time is None:
+            return None
+        return self.frame_seconds / max(self._frame_time, 1e-9)
+
+    @property
+    def target_frames(self) -> int:
+        """Number of frames to buffer before playing"""
+        seconds = self._floor
+        speed = self.speed
+        if speed is not None:
+            # Slower renderers need more buffered to get through the song
+            headroom = speed - 1
+            if headroom <= 0:
+                seconds = self.max_target
+            elif headroom < 1:
+                seconds = self._floor / headroom
+        seconds = min(max(seconds, self._floor), self.max_target)
+        frames = math.ceil(seconds / self.frame_seconds)
+        return min(frames, self.capacity - 1)
+
+    # - Producer
+
+    def fill_from(self, readinto: Callable[[memoryview], Optional[int]]) -> bool:
+        """Fills frames using readinto until it returns no bytes
+
+        The last frame is padded with zeros. Any exception is passed on to
+        the consumer after the buffered frames are read. Returns whether the
+        end was reached (False if stopped or errored).
+
+        """
+        frame_size = self.frame_size
+        error = None
+        try:
+            while True:
+                with self._cond:
+                    while (
+                        not self._stopped
+                        and self.buffered >= self.capacity - 1
+                    ):
+                        self._cond.wait()
+                    if self._stopped:
+                        return False
+                    slot = self._written % self.capacity
+                frame = self._view[slot * frame_size:(slot + 1) * frame_size]
+                start = time.perf_counter()
+                filled = 0
+                while filled < frame_size:
+                    count = readinto(frame[filled:])
+                    if not count:
+                        break
+                    filled += count
+                elapsed = time.perf_counter() - start
+                if filled == 0:
+                    return True
+                if filled < frame_size:
+                    frame[filled:] = self._silence[filled:]
+                with self._cond:
+                    self._written += 1
+                    if self._frame_time is None:
+                        self._frame_time = elapsed
+                    else:
+                        self._frame_time += (elapsed - self._frame_time) * 0.05
+                    self._cond.notify_all()
+                if filled < frame_size:
+                    return True
+        except BaseException as e:
+            error = e
+            return False
+        finally:
+            self.close(error)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """Marks the producer as finished"""
+        with self._cond:
+            self._closed = True
+            if error is not None and self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+    # - Consumer
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until enough frames are buffered to start playing"""
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: (
+                    self._closed
+                    or self._stopped
+                    or self.buffered >= self.target_frames
+                ),
+                timeout,
+            )
+            if ready:
+                self._buffering = False
+            return ready
+
+    def read(self) -> Optional[memoryview]:
+        """Returns the next frame, silence while buffering, or None at the end
+
+        This never blocks for the producer.
+
+        """
+        with self._cond:
+            buffered = self.buffered
+            if buffered == 0 and self._closed:
+                if self._error is not None:
+                    raise self._error
+                return None
+            if self._buffering:
+                if buffered < self.target_frames and not self._closed:
+                    return self._silence
+                self._buffering = False
+            if buffered == 0:
+                # Ran dry, so aim higher and play silence while refilling
+                self.underruns += 1
+                self._floor = min(self._floor * 1.5, self.max_target)
+                self._buffering = True
+                return self._silence
+            slot = self._read % self.capacity
+            self._read += 1
+            self._cond.notify_all()
+        return self._view[slot * self.frame_size:(slot + 1) * self.frame_size]
+
+    def stop(self) -> None:
+        """Tells the producer to stop"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
@@ -5,6 +5,8 @@ import inspect
 import discord
 from discord.ext import commands
 
+from http_client import HTTPClient
+
 # These extensions are loaded automatically on startup
 LOAD_ON_STARTUP = (
     "admin", "censor", "chant", "music", "database", "thicc", "gee", "remind",
@@ -44,6 +46,9 @@ async def _run(token, **bot_kwargs):
     # Helper for improving compatibility between discord.py v1.x and v2.x
     bot.wrap_async = _wrap_async
 
+    # Shared HTTP client so extensions reuse connections
+    bot.http_client = HTTPClient()
+
     # Get list of extensions to load
     extensions = list(LOAD_ON_STARTUP)
     if int(os.environ.get("JOSHGONE_REPL", "0")):
@@ -58,6 +63,7 @@ async def _run(token, **bot_kwargs):
     try:
         await bot.start(token)
     finally:
+        await bot.http_client.close()
         # Force the GC to run before closing the loop so objects that use
         # loop.call_soon in their .__del__ methods can be garbage collected
         # without giving an annoying `Exception ignored in <something>
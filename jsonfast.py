@@ -198,6 +198,147 @@ def skim(data: bytes, i: int, j: int) -> Iterator[Tuple[int, int, int]]:
         except IndexError:
             break
 
+# - Streaming
+
+_WHITESPACE_PATTERN = re.compile(br"[ \t\n\r]*")
+_STRING_CHAR_PATTERN = re.compile(br'["\\]')
+_SCALAR_END_PATTERN = re.compile(br"[ \t\n\r,\]]")
+
+class ArrayParser:
+    """Resumable parser for the elements of a JSON array read in parts
+
+    Each call to feed scans only the new bytes, keeping its place (and the
+    stack of open arrays, objects and strings) between calls, and returns
+    the raw bytes of the elements that were completed. Bytes of finished
+    elements are dropped from the buffer.
+
+    Example:
+        >>> parser = ArrayParser()
+        >>> parser.feed(b' [ 12, {"a": "]\\\\\\\\"')
+        [b'12']
+        >>> parser.feed(b'}, [true], 3')
+        [b'{"a": "]\\\\\\\\"}', b'[true]']
+        >>> parser.feed(b"] ")
+        [b'3']
+        >>> parser.done
+        True
+
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._i = 0  # Where to continue scanning from
+        self._start = 0  # Where the current element starts
+        self._state = "begin"
+        # Closing chars of the open arrays and objects in the element
+        self._stack = bytearray()
+        self._in_string = False
+        self.done = False
+
+    def feed(self, data: bytes) -> list:
+        """Adds data and returns the elements completed by it"""
+        buffer = self._buffer
+        buffer += data
+        i = self._i
+        start = self._start
+        state = self._state
+        stack = self._stack
+        in_string = self._in_string
+        elements = []
+        while i < len(buffer):
+            if state == "nested":
+                if in_string:
+                    match = _STRING_CHAR_PATTERN.search(buffer, i)
+                    if match is None:
+                        i = len(buffer)
+                        break
+                    i = match.end()
+                    if buffer[i - 1] == b"\\"[0]:
+                        i += 1  # Skip the escaped char (maybe not read yet)
+                    else:
+                        in_string = False
+                        if not stack:  # The element was a string
+                            elements.append(bytes(buffer[start:i]))
+                            state = "after"
+                    continue
+                # Skips to the next bracket or string that doesn't end in
+                # the buffer
+                i = _READ_NESTED_PATTERN.match(buffer, i).end()
+                if i == len(buffer):
+                    break
+                char = buffer[i]
+                i += 1
+                if char == b'"'[0]:
+                    in_string = True
+                elif char in b"[{":
+                    stack.append(char + 2)  # The matching ] or }
+                elif char != stack[-1]:
+                    raise ValueError(f"unexpected {chr(char)!r} at {i - 1}")
+                else:
+                    stack.pop()
+                    if not stack:
+                        elements.append(bytes(buffer[start:i]))
+                        state = "after"
+            elif state == "scalar":
+                match = _SCALAR_END_PATTERN.search(buffer, i)
+                if match is None:
+                    i = len(buffer)
+                    break
+                i = match.start()
+                elements.append(bytes(buffer[start:i]))
+                state = "after"
+            else:
+                i = _WHITESPACE_PATTERN.match(buffer, i).end()
+                if i == len(buffer):
+                    break
+                char = buffer[i]
+                if state == "begin":
+                    if char != b"["[0]:
+                        raise ValueError("expected a JSON array")
+                    state = "first"
+                    i += 1
+                elif state in ("first", "value"):
+                    if char == b"]"[0] and state == "first":
+                        state = "end"
+                        self.done = True
+                        i += 1
+                        continue
+                    if char in b",:]}":
+                        raise ValueError(f"unexpected {chr(char)!r} at {i}")
+                    start = i
+                    i += 1
+                    if char in b"[{":
+                        stack.append(char + 2)
+                        state = "nested"
+                    elif char == b'"'[0]:
+                        in_string = True
+                        state = "nested"
+                    else:
+                        state = "scalar"
+                elif state == "after":
+                    if char == b","[0]:
+                        state = "value"
+                    elif char == b"]"[0]:
+                        state = "end"
+                        self.done = True
+                    else:
+                        raise ValueError(f"unexpected {chr(char)!r} at {i}")
+                    i += 1
+                else:
+                    raise ValueError(f"unexpected data after the array at {i}")
+        # Drop what's been scanned, except for an unfinished element
+        keep = start if state in ("nested", "scalar") else min(i, len(buffer))
+        del buffer[:keep]
+        self._i = i - keep
+        self._start = start - keep if state in ("nested", "scalar") else 0
+        self._state = state
+        self._in_string = in_string
+        return elements
+
+    def close(self) -> None:
+        """Raises ValueError if the array hasn't ended"""
+        if not self.done:
+            raise ValueError("unexpected EOF while parsing JSON")
+
 def to_str(data: bytes, i: int, j: int) -> str:
     return data[i:j-1].decode("unicode_escape")
 
@@ -0,0 +1,19 @@
+"""
+Music queues
+"""
+
+from yoyo import step
+
+__depends__ = {'20210628_01_S6ssq-chant-owner'}
+
+steps = [
+    step("PRAGMA foreign_keys = ON;"),
+    step(
+        '''CREATE TABLE music_queue (
+            server_id INTEGER PRIMARY KEY,
+            snapshot BLOB,
+            FOREIGN KEY (server_id) REFERENCES server (server_id)
+        );''',
+        "DROP TABLE music_queue;",
+    ),
+]
@@ -0,0 +1,312 @@
+"""On-disk cache for Online Sequencer songs
+
+Playing a sequence means fetching its page, parsing the protobuf and rendering
+every note, all over again each time. This cache keeps two tiers of files in a
+directory, both keyed by the sequence id plus a hash of the settings file and
+the render options (like the voice cap) that change the output:
+
+    notes: the parsed note infos in a columnar file (<key>.notes)
+    audio: the fully rendered 16-bit 48kHz stereo PCM (<key>.pcm)
+
+Rendered audio is played straight from the file with memory-mapped reads.
+Each tier has a size cap. When it's exceeded, the least recently used files
+(by modification time, which is updated on every hit) are removed.
+
+Notes file layout (little endian):
+    b"OSN1", note count (4 byte unsigned integer)
+    instruments (4 byte signed integers), note types (see NOTE_TYPES in
+    online_sequencer_note_stream.py), flags (1 if sorted), then times,
+    lengths, volumes and detunes (8 byte floats), one column after another
+
+"""
+import array
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import online_sequencer_note_stream as ns
+
+NOTES_MAGIC = b"OSN1"
+FRAME_SIZE = 3840  # 20ms of 16-bit stereo 48kHz audio
+
+# Columns of the notes file and their array typecodes
+_NOTE_COLUMNS = (
+    ("instrument", "i"),
+    ("type", "B"),
+    ("flags", "B"),
+    ("time", "d"),
+    ("length", "d"),
+    ("volume", "d"),
+    ("detune", "d"),
+)
+
+def _column_bytes(column: array.array) -> bytes:
+    if sys.byteorder != "little" and column.itemsize > 1:
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+def dump_notes(note_infos: Iterable[dict]) -> bytes:
+    """Returns the note infos in the columnar notes format"""
+    columns = {name: array.array(code) for name, code in _NOTE_COLUMNS}
+    indices = ns.NOTE_TYPE_INDICES
+    for note_info in note_infos:
+        columns["instrument"].append(note_info["instrument"])
+        columns["type"].append(indices[note_info["type"]])
+        columns["flags"].append(ns.FLAG_SORTED if note_info.get("sorted") else 0)
+        columns["time"].append(note_info["time"])
+        columns["length"].append(note_info["length"])
+        columns["volume"].append(note_info["volume"])
+        columns["detune"].append(note_info.get("detune", 0))
+    count = len(columns["instrument"])
+    return b"".join([
+        NOTES_MAGIC,
+        count.to_bytes(4, "little"),
+        *(_column_bytes(columns[name]) for name, _ in _NOTE_COLUMNS),
+    ])
+
+def load_notes(data: bytes) -> List[dict]:
+    """Returns the note infos from the columnar notes format"""
+    if data[:4] != NOTES_MAGIC:
+        raise ValueError("not a notes file")
+    count = int.from_bytes(data[4:8], "little")
+    columns = []
+    offset = 8
+    for _, code in _NOTE_COLUMNS:
+        column = array.array(code)
+        end = offset + count * column.itemsize
+        column.frombytes(data[offset:end])
+        if sys.byteorder != "little":
+            column.byteswap()
+        columns.append(column)
+        offset = end
+    if len(columns[-1]) != count:
+        raise ValueError("notes file is truncated")
+    note_types = ns.NOTE_TYPES
+    note_infos = []
+    for instrument, type_, flags, time, length, volume, detune in zip(*columns):
+        note_info = {
+            "instrument": instrument,
+            "type": note_types[type_],
+            "time": time,
+            "length": length,
+            "volume": volume,
+            "detune": detune,
+        }
+        if flags & ns.FLAG_SORTED:
+            note_info["sorted"] = 1
+        note_infos.append(note_info)
+    return note_infos
+
+def read_audio_frames(path: str) -> Iterator[memoryview]:
+    """Yields memoryviews of each 20ms frame in the audio file"""
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        for start in range(0, len(view), FRAME_SIZE):
+            yield view[start:start + FRAME_SIZE]
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # A frame is still in use, so let it be garbage collected
+
+class _Tier:
+    def __init__(self, suffix, max_size):
+        self.suffix = suffix
+        self.max_size = max_size
+        self.hits = self.misses = self.evictions = 0
+
+class AudioWriter:
+    """Writes rendered audio into the cache as it is played
+
+    The file only becomes visible to the cache once commit is called.
+
+    """
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+        self._path = cache._path("audio", key)
+        self._temp_path = f"{self._path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._temp_path, "wb")
+        self.size = 0
+
+    def write(self, data) -> None:
+        if self._file is None:
+            return
+        # Stop saving songs that would never fit in the cache
+        if self.size + len(data) > self._cache.tiers["audio"].max_size:
+            self.abort()
+            return
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self) -> None:
+        if self._file is None:
+            return
+        # Pad the last frame so that every frame is whole
+        padding = -self.size % FRAME_SIZE
+        self._file.write(bytes(padding))
+        self._file.close()
+        self._file = None
+        if self.size == 0:
+            os.remove(self._temp_path)
+            return
+        os.replace(self._temp_path, self._path)
+        self._cache._evict("audio")
+
+    def abort(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+class OSCache:
+    """Two tier cache for parsed notes and rendered audio"""
+
+    def __init__(
+        self,
+        directory: str,
+        settings_path: str,
+        *,
+        notes_size: int = 64 * 2**20,
+        audio_size: int = 2**30,
+        render_options: Optional[Dict[str, Any]] = None,
+    ):
+        self.directory = directory
+        self.settings_path = settings_path
+        self._render_options = json.dumps(render_options or {}, sort_keys=True).encode()
+        self.tiers = {
+            "notes": _Tier(".notes", notes_size),
+            "audio": _Tier(".pcm", audio_size),
+        }
+        self._lock = threading.Lock()
+        self._settings_stat = None
+        self._settings_hash = None
+        os.makedirs(directory, exist_ok=True)
+        # Remove partly written files left by a previous process
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".tmp"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def key(self, sequence_id: int) -> str:
+        """Returns the cache key for a sequence with the current settings"""
+        stat = os.stat(self.settings_path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if stat != self._settings_stat:
+            with open(self.settings_path, "rb") as file:
+                digest = hashlib.sha256(file.read())
+            digest.update(self._render_options)
+            self._settings_hash = digest.hexdigest()[:16]
+            self._settings_stat = stat
+        return f"{sequence_id}-{self._settings_hash}"
+
+    def _path(self, tier: str, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.tiers[tier].suffix}")
+
+    def _lookup(self, tier: str, key: str) -> Optional[str]:
+        # Returns the path if it's cached and marks it as recently used
+        path = self._path(tier, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.tiers[tier].misses += 1
+            return None
+        self.tiers[tier].hits += 1
+        return path
+
+    def _entries(self, tier: str) -> List[os.DirEntry]:
+        suffix = self.tiers[tier].suffix
+        return [
+            entry for entry in os.scandir(self.directory)
+            if entry.name.endswith(suffix)
+        ]
+
+    def _evict(self, tier: str) -> None:
+        # Removes the least recently used files until the tier fits
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in self._entries(tier):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+            entries.sort()
+            max_size = self.tiers[tier].max_size
+            for _, size, path in entries:
+                if total <= max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue  # Still being played on Windows
+                total -= size
+                self.tiers[tier].evictions += 1
+
+    # - Notes tier
+
+    def get_notes(self, key: str) -> Optional[List[dict]]:
+        path = self._lookup("notes", key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return load_notes(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def put_notes(self, key: str, note_infos: Iterable[dict]) -> None:
+        path = self._path("notes", key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(dump_notes(note_infos))
+        os.replace(temp_path, path)
+        self._evict("notes")
+
+    # - Audio tier
+
+    def get_audio(self, key: str) -> Optional[str]:
+        """Returns the path to the rendered audio if it's cached"""
+        return self._lookup("audio", key)
+
+    def open_audio(self, key: str) -> AudioWriter:
+        return AudioWriter(self, key)
+
+    # - Stats
+
+    def stats(self) -> dict:
+        """Returns entries, bytes, max_bytes, hits, misses and evictions for
+        each tier"""
+        stats = {}
+        for name, tier in self.tiers.items():
+            sizes = []
+            for entry in self._entries(name):
+                try:
+                    sizes.append(entry.stat().st_size)
+                except FileNotFoundError:
+                    pass
+            stats[name] = {
+                "entries": len(sizes),
+                "bytes": sum(sizes),
+                "max_bytes": tier.max_size,
+                "hits": tier.hits,
+                "misses": tier.misses,
+                "evictions": tier.evictions,
+            }
+        return stats
@@ -6,12 +6,18 @@ import os
 import subprocess
 import re
 
-import httpx
+from http_client import HTTPClient
 
-async def get_instrument_settings():
+async def get_instrument_settings(*, client=None):
+    # Borrow the client if given, otherwise make one for both requests
+    if client is None:
+        client = HTTPClient()
+        try:
+            return await get_instrument_settings(client=client)
+        finally:
+            await client.close()
     # Get JS filename
-    async with httpx.AsyncClient() as client:
-        response = await client.get("https://onlinesequencer.net/")
+    response = await client.get("https://onlinesequencer.net/")
     # More fragile than your mom
     match = re.search(
         r'<script type="text/javascript" src="(/resources/[^"]*)"></script>',
@@ -21,8 +27,7 @@ async def get_instrument_settings():
         raise RuntimeError("resources script not found")
     filename = match[1].lstrip("/")
     # Get settings JSON
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"https://onlinesequencer.net/{filename}")
+    response = await client.get(f"https://onlinesequencer.net/{filename}")
     match = re.search(r"var settings=({(?:(?!};).)*});", response.text)
     if match is None:
         raise RuntimeError("settings JSON not found")
@@ -94,6 +99,14 @@ def main(directory):
         print(f"Downloading audio file for instrument {instrument}...")
         download_instrument_audio(directory, instrument)
 
+    try:
+        import online_sequencer_sample_bank as sample_bank
+    except ImportError:
+        print("Skipping sample banks (NumPy isn't installed)...")
+        return
+    print("Decoding instrument audio files into sample banks...")
+    sample_bank.build_directory(directory, force=True)
+
 parser = argparse.ArgumentParser(
     description="Downloads Online Sequencer settings and audio files.",
 )
@@ -5,14 +5,15 @@ import asyncio
 import enum
 import re
 import base64
-from typing import Optional, Iterable
+from typing import Optional, Iterator
 from dataclasses import dataclass, fields
 
-import httpx
+import numpy
 from pure_protobuf.dataclasses_ import field, optional_field, message
 from pure_protobuf.types import int32
 
 import protobufast as pf
+from http_client import HTTPClient
 
 # - Protobuf schemas
 # Converted from https://onlinesequencer.net/sequence.proto and
@@ -85,6 +86,45 @@ class Sequence:
     notes: list[Note] = field(2, default_factory=list)
     markers: list[Marker] = field(3, default_factory=list)
 
+# Compiled decoders for the schemas above (see protobufast.compile_message).
+# Markers aren't used so they're skipped.
+FastNote = pf.compile_message("Note", [
+    pf.Field(1, "type", "enum"),
+    pf.Field(2, "time", "float"),
+    pf.Field(3, "length", "float"),
+    pf.Field(4, "instrument", "int32"),
+    pf.Field(5, "volume", "float"),
+])
+
+FastInstrumentSettings = pf.compile_message("InstrumentSettings", [
+    pf.Field(1, "volume", "float"),
+    pf.Field(2, "delay", "bool"),
+    pf.Field(3, "reverb", "bool"),
+    pf.Field(4, "pan", "float"),
+    pf.Field(5, "enable_eq", "bool"),
+    pf.Field(6, "eq_low", "float"),
+    pf.Field(7, "eq_mid", "float"),
+    pf.Field(8, "eq_high", "float"),
+    pf.Field(9, "detune", "float"),
+])
+
+FastInstrumentSettingsPair = pf.compile_message("InstrumentSettingsPair", [
+    pf.Field(1, "key", "int32", default=None),
+    pf.Field(2, "value", FastInstrumentSettings),
+])
+
+FastSequenceSettings = pf.compile_message("SequenceSettings", [
+    pf.Field(1, "bpm", "int32"),
+    pf.Field(2, "time_signature", "int32"),
+    pf.Field(3, "instruments", FastInstrumentSettingsPair, repeated=True),
+    pf.Field(4, "one_minus_volume", "float"),
+])
+
+FastSequence = pf.compile_message("Sequence", [
+    pf.Field(1, "settings", FastSequenceSettings),
+    pf.Field(2, "notes", FastNote, repeated=True),
+])
+
 # - Helpers
 
 def _extract_data(text):
@@ -103,93 +143,144 @@ def _field_num_of(cls, name: str) -> int:
             return field.metadata["number"]
     raise AttributeError(f'no message field named: {name}')
 
-def _skim_field(field: int, msgs: Iterable) -> Iterable:
-    for msg in msgs:
-        if msg[2] == field:
-            yield msg
+# Note info types by NoteType value (C0, C#0, ..., B8)
+_NOTE_TYPE_NAMES = [note_type.name.replace("S", "#") for note_type in NoteType]
 
-def _last_field(field: int, msgs: Iterable):
-    msg = None
-    for msg in _skim_field(field, msgs):
-        pass
-    return msg
+class NoteColumns:
+    """Notes of a sequence as NumPy columns sorted by time
 
-def _get_notes(data) -> Iterable[dict]:
-    """Converts raw song data into a sorted iterable of notes"""
+    type (NoteType values), time, length, instrument, volume and detune have
+    one entry per note, with the song's settings already applied. Iterating
+    makes the note info dicts one at a time.
+
+    """
+    def __init__(self, type, time, length, instrument, volume, detune):
+        self.type = type
+        self.time = time
+        self.length = length
+        self.instrument = instrument
+        self.volume = volume
+        self.detune = detune
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __iter__(self) -> Iterator[dict]:
+        names = _NOTE_TYPE_NAMES
+        columns = zip(
+            self.instrument.tolist(),
+            self.type.tolist(),
+            self.time.tolist(),
+            self.length.tolist(),
+            self.volume.tolist(),
+            self.detune.tolist(),
+        )
+        first = True
+        for instrument, type_, time, length, volume, detune in columns:
+            note_info = {
+                "instrument": instrument,
+                "type": names[type_],
+                "time": _int_or_float(time),
+                "length": _int_or_float(length),
+                "volume": _int_or_float(volume),
+                "detune": _int_or_float(detune),
+            }
+            if first:
+                first = False
+                note_info["sorted"] = 1
+            yield note_info
+
+def _get_note_columns(data) -> NoteColumns:
+    """Decodes the notes of raw song data into columns in one pass"""
     settings_num = _field_num_of(Sequence, "settings")
-    settings = SequenceSettings.loads(b"".join(
-        data[msg[3]:msg[0]]
-        for msg in _skim_field(settings_num, pf.skim(data, 0, len(data)))
-    ))
-    song = Sequence()
-    song.settings = settings
-
-    bpm = song.settings.bpm
-    all_volume = 1 - song.settings.one_minus_volume
-    # Convert to a dict for constant instrument settings retrieval
-    instrument_settings = {
-        kv.key: kv.value
-        for kv in song.settings.instruments
-        if kv.key is not None and kv.value is not None
-    }
-
-    # Sort note messages by time (without loading all fields of a note)
     notes_num = _field_num_of(Sequence, "notes")
-    time_num = _field_num_of(Note, "time")
-    def msg_note_time(msg):
-        time_msg = _last_field(time_num, pf.skim(data, msg[3], msg[0]))
-        if time_msg is None:
-            return 0.0
-        assert time_msg[1] == 5
-        return pf.to_float(data, time_msg[3], time_msg[0])
-    note_msgs = sorted(
-        _skim_field(notes_num, pf.skim(data, 0, len(data))),
-        key=msg_note_time,
+
+    settings_msgs = []
+    notes = []
+    decode_note = FastNote.decode_tuple
+    read = pf.read
+    i = 0
+    size = len(data)
+    while i < size:
+        i, wire_type, field, value = read(data, i)
+        if wire_type != 2:
+            continue
+        if field == notes_num:
+            notes.append(decode_note(data, value, i))
+        elif field == settings_num:
+            settings_msgs.append(data[value:i])
+    if notes:
+        types, times, lengths, instruments, volumes = zip(*notes)
+    else:
+        types = times = lengths = instruments = volumes = ()
+
+    # Settings can be split up, in which case they're merged
+    settings = FastSequenceSettings.decode(b"".join(settings_msgs))
+    bpm = settings.bpm
+    all_volume = 1 - settings.one_minus_volume
+
+    # Sort by the stored time (the same order as sorting the messages)
+    times = numpy.array(times, dtype=numpy.float64)
+    order = numpy.argsort(times, kind="stable")
+    types = numpy.array(types, dtype=numpy.int64)[order]
+    if len(types) and (types.min() < 0 or types.max() >= len(NoteType)):
+        raise ValueError("unknown note type in sequence")
+    times = times[order]
+    lengths = numpy.array(lengths, dtype=numpy.float64)[order]
+    instruments = numpy.array(instruments, dtype=numpy.int64)[order]
+    volumes = numpy.array(volumes, dtype=numpy.float64)[order]
+
+    # Apply each instrument's settings to all of its notes at once
+    instrument_volumes = numpy.ones(len(order))
+    detunes = numpy.zeros(len(order))
+    for kv in settings.instruments:
+        if kv.key is None or kv.value is None:
+            continue
+        mask = instruments == kv.key
+        instrument_volumes[mask] = kv.value.volume
+        detunes[mask] = kv.value.detune
+
+    if len(order):
+        times *= 60/bpm/4
+        lengths *= 60/bpm/4
+    return NoteColumns(
+        type=types,
+        time=times,
+        length=lengths,
+        instrument=instruments,
+        volume=volumes * all_volume * instrument_volumes,
+        detune=detunes,
     )
 
-    # Return a iterator of note infos sorted by time
-    first = True
-    for msg in note_msgs:
-        note = Note.loads(data[msg[3]:msg[0]])
-        note_info = {
-            "instrument": note.instrument,
-            "type": note.type.name.replace("S", "#"),
-            "time": _int_or_float(note.time * (60/bpm/4)),
-            "length": _int_or_float(note.length * (60/bpm/4)),
-            "volume": _int_or_float(
-                note.volume
-                * all_volume
-                * (
-                    instrument_settings[note.instrument].volume
-                    if note.instrument in instrument_settings
-                    else 1
-                )
-            ),
-            "detune": _int_or_float(
-                instrument_settings[note.instrument].detune
-                if note.instrument in instrument_settings
-                else 0
-            ),
-        }
-        if first:
-            first = False
-            note_info["sorted"] = 1
-        yield note_info
+def _get_notes(data) -> Iterator[dict]:
+    """Converts raw song data into a sorted iterator of notes
+
+    Nothing is decoded until the first note is asked for.
+
+    """
+    yield from _get_note_columns(data)
 
 # - "Public" API
 
-async def get_note_infos_stream(url):
-    async with httpx.AsyncClient() as client:
+async def get_note_infos_stream(url, *, client=None):
+    # Borrow the client if given, otherwise make one just for this
+    if client is None:
+        client = HTTPClient()
+        try:
+            response = await client.get(url)
+        finally:
+            await client.close()
+    else:
         response = await client.get(url)
-        text = response.text
+    text = response.text
     def _get_note_infos():
+        # Decode here so it doesn't happen on the event loop
         data = _extract_data(text)
-        note_infos = _get_notes(data)
-        return note_infos
+        return iter(_get_note_columns(data))
     return await asyncio.to_thread(_get_note_infos)
 
-async def get_note_infos(url):
-    infos = await get_note_infos_stream(url)
+async def get_note_infos(url, *, client=None):
+    infos = await get_note_infos_stream(url, client=client)
     return await asyncio.to_thread(lambda: list(infos))
 
 # - Command line
@@ -2,16 +2,532 @@ import argparse
 import sys
 import json
 import inspect
+import collections
+import concurrent.futures
+import math
+import os
+import subprocess
+import time
+import wave
 
 import soundit as s
 import jsonfast as jf
 
+import online_sequencer_note_stream as ns
+
+try:
+    import numpy
+except ImportError:
+    has_numpy = False
+else:
+    has_numpy = True
+    import online_sequencer_sample_bank as sample_bank
+
+def _can_mix_blocks():
+    return has_numpy and getattr(s, "has_numpy", False) and hasattr(s, "_to_numpy")
+
 def make_chunks(infos, **kwargs):
     """Generate chunks from note infos"""
+    if _can_mix_blocks():
+        return make_sound(infos, mix_blocks=True, **kwargs)
     return s.chunked(make_sound(infos, **kwargs))
 
-def make_sound(note_infos, *, settings, template, cache=None):
-    """Generate a sound from note infos"""
+def _timed(iterator, timings, name):
+    """Yields from iterator, adding the seconds spent in it to timings[name]"""
+    iterator = iter(iterator)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[name] = timings.get(name, 0) + time.perf_counter() - start
+        yield item
+
+def render_sound(sound):
+    """Returns all of a mono sound's samples as a NumPy array"""
+    arrays = list(s._to_numpy(sound))
+    if not arrays:
+        return numpy.zeros(0)
+    return numpy.concatenate(arrays)
+
+RESAMPLERS = ("linear", "polyphase")
+
+def resample(samples, factor, *, count=None, method="linear"):
+    """Resamples a NumPy array of samples
+
+    Output sample i is at input sample i * factor, so factors above 1 raise
+    the pitch and shorten the sound. At most count samples are made (by
+    default, as many as the input covers).
+
+    The linear method interpolates like soundit's _resample_linear. The
+    polyphase method uses a windowed sinc filter (see _polyphase_filters),
+    which is slower but doesn't dull or alias the sound as much.
+
+    """
+    length = len(samples)
+    if length == 0:
+        return numpy.zeros(0)
+    total = int((length - 1) / factor) + 1
+    if count is None or count > total:
+        count = total
+    positions = numpy.arange(count) * factor
+    indices = positions.astype(numpy.intp)
+    fractions = positions - indices
+    if method == "linear":
+        after = numpy.minimum(indices + 1, length - 1)
+        current = samples[indices]
+        return current + (samples[after] - current) * fractions
+    if method != "polyphase":
+        raise ValueError(f"unknown resampling method: {method!r}")
+    filters = _polyphase_filters(min(1.0, 1 / factor))
+    phases, taps = filters.shape
+    # Pad so every tap has a sample to read
+    half = taps // 2
+    padded = numpy.zeros(length + taps)
+    padded[half:half + length] = samples
+    output = numpy.empty(count)
+    # Work in slices to bound the size of the gathered windows
+    step = max(1, 2**16 // taps)
+    # Tap t reads input sample i + t - half + 1 (which is shifted by half)
+    offsets = numpy.arange(taps) + 1
+    for start in range(0, count, step):
+        stop = min(start + step, count)
+        windows = padded[indices[start:stop, None] + offsets]
+        phase = (fractions[start:stop] * phases).astype(numpy.intp)
+        numpy.einsum("ij,ij->i", windows, filters[phase], out=output[start:stop])
+    return output
+
+_polyphase_cache = {}
+
+def _polyphase_filters(cutoff, *, taps=16, phases=256):
+    """Returns a (phases, taps) table of windowed sinc filters
+
+    Row p is the filter for a position p / phases of the way between two
+    samples. cutoff is the lowpass cutoff as a fraction of the Nyquist
+    frequency (lowered when downsampling to stop aliasing).
+
+    """
+    key = (cutoff, taps, phases)
+    filters = _polyphase_cache.get(key)
+    if filters is None:
+        half = taps // 2
+        # Distance from each tap to the output position
+        distances = (
+            numpy.arange(taps)[None, :] - half + 1
+            - numpy.arange(phases)[:, None] / phases
+        )
+        # Kaiser window over the taps
+        beta = 8.0
+        window = numpy.i0(
+            beta * numpy.sqrt(numpy.clip(1 - (distances / half)**2, 0, 1))
+        ) / numpy.i0(beta)
+        filters = cutoff * numpy.sinc(cutoff * distances) * window
+        filters /= filters.sum(axis=1, keepdims=True)
+        filters.flags.writeable = False
+        filters = _polyphase_cache[key] = filters
+    return filters
+
+class ResampleCache:
+    """LRU cache of resampled notes, keyed by (instrument, sample note,
+    cents), limited to max_bytes of samples
+
+    Each entry remembers how many samples were made and whether that's the
+    whole sound, so a longer note of the same pitch only resamples again if
+    it needs more than what's cached.
+
+    """
+    def __init__(self, *, max_bytes=128 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, count, make):
+        """Returns at least count samples (or the whole sound) for key, using
+        make(count) on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            samples, complete = entry
+            if complete or len(samples) >= count:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return samples
+            self.size -= samples.nbytes
+            del self._entries[key]
+        self.misses += 1
+        samples, complete = make(count)
+        samples.flags.writeable = False
+        self._entries[key] = (samples, complete)
+        self.size += samples.nbytes
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, (old, _) = self._entries.popitem(last=False)
+            self.size -= old.nbytes
+        return samples
+
+# Synth instruments 13 to 16
+WAVEFORMS = ("sine", "square", "sawtooth", "triangle")
+# Each wavetable holds one cycle in 2**WAVETABLE_BITS samples
+WAVETABLE_BITS = 12
+
+_wavetables = {}
+
+def _wavetable(waveform):
+    """Returns one cycle of the waveform (same formulas as soundit's)"""
+    table = _wavetables.get(waveform)
+    if table is None:
+        phases = numpy.arange(2**WAVETABLE_BITS) / 2**WAVETABLE_BITS
+        if waveform == "sine":
+            table = numpy.sin(2*math.pi * phases)
+        elif waveform == "square":
+            table = (phases >= 0.5) * 2.0 - 1
+        elif waveform == "sawtooth":
+            table = ((phases + 0.5) % 1 - 0.5) * 2
+        elif waveform == "triangle":
+            table = (-numpy.abs(-((phases + 0.25) % 1) + 0.5) + 0.25) * 4
+        else:
+            raise ValueError(f"unknown waveform: {waveform!r}")
+        table.flags.writeable = False
+        _wavetables[waveform] = table
+    return table
+
+# Most bytes of samples synth_note keeps for recent notes (in each process)
+SYNTH_CACHE_BYTES = 32 * 2**20
+
+_synth_cache = collections.OrderedDict()
+_synth_cache_size = 0
+
+def synth_note(waveform, freq, count, volume, *, fade=0.005):
+    """Returns count samples of a synth note as a read only array
+
+    A 32-bit phase accumulator indexes the waveform's wavetable, with linear
+    interpolation between entries. The note fades in and out over fade
+    seconds like soundit's fade. Recently used notes are cached, up to
+    SYNTH_CACHE_BYTES of samples.
+
+    """
+    global _synth_cache_size
+    key = (waveform, freq, count, volume, fade)
+    samples = _synth_cache.get(key)
+    if samples is not None:
+        _synth_cache.move_to_end(key)
+        return samples
+    samples = _synth_note(waveform, freq, count, volume, fade)
+    if samples.nbytes <= SYNTH_CACHE_BYTES:
+        _synth_cache[key] = samples
+        _synth_cache_size += samples.nbytes
+        while _synth_cache_size > SYNTH_CACHE_BYTES:
+            _, old = _synth_cache.popitem(last=False)
+            _synth_cache_size -= old.nbytes
+    return samples
+
+def _synth_note(waveform, freq, count, volume, fade):
+    table = _wavetable(waveform)
+    increment = round(freq / s.RATE * 2**32) % 2**32
+    phases = numpy.arange(count, dtype=numpy.uint64) * increment
+    phases &= 2**32 - 1
+    shift = 32 - WAVETABLE_BITS
+    indices = (phases >> shift).astype(numpy.intp)
+    fractions = (phases & (2**shift - 1)) / 2**shift
+    samples = table[indices]
+    samples += (table[(indices + 1) % len(table)] - samples) * fractions
+    samples *= volume
+    # Fade envelope: the smallest of the fade in, the fade out and 1
+    fade_samples = int(fade * s.RATE)
+    if fade_samples:
+        envelope = numpy.arange(1, count + 1, dtype=float)
+        numpy.minimum(envelope, envelope[::-1], out=envelope)
+        envelope /= fade_samples
+        numpy.minimum(envelope, 1, out=envelope)
+        samples *= envelope
+    samples.flags.writeable = False
+    return samples
+
+class VoiceAllocator:
+    """Caps how many notes play at once by stealing voices
+
+    A note holds a voice from when it starts until span(note_info) samples
+    later. When a note starts and every voice is taken, one is stolen: the
+    oldest (the note that started first) or the quietest (the lowest
+    loudness(note_info), which can be the new note itself). Stolen notes get
+    the sample they stop at as note_info["stop"], where mix_notes fades them
+    out over VOICE_RELEASE seconds. Notes stolen before they play anything
+    are left out.
+
+    stolen counts the notes that were cut short or left out.
+
+    """
+    STEAL = ("oldest", "quietest")
+
+    def __init__(self, voices, *, steal="oldest"):
+        if voices < 1:
+            raise ValueError(f"voices must be at least 1: {voices!r}")
+        if steal not in self.STEAL:
+            raise ValueError(f"unknown steal policy: {steal!r}")
+        self.voices = voices
+        self.steal = steal
+        self.stolen = 0
+
+    def allocate(self, note_infos, *, span, loudness):
+        """Yields copies of the (sorted) note infos that get to play"""
+        # Playing notes as [end sample, loudness, note info] by start
+        playing = []
+        # Notes starting on the same sample are held back until all of them
+        # are allocated, so that ones stolen right away aren't rendered
+        group = []
+        group_start = None
+        first_time = None
+        for note_info in note_infos:
+            if first_time is None:
+                first_time = note_info["time"]
+            start = round((note_info["time"] - first_time) * s.RATE)
+            if start != group_start:
+                for grouped in group:
+                    if grouped.get("stop") != group_start:
+                        yield grouped
+                group = []
+                group_start = start
+                playing = [voice for voice in playing if voice[0] > start]
+            note_info = dict(note_info)
+            group.append(note_info)
+            end = start + span(note_info)
+            if end <= start:
+                continue  # Doesn't play anything so doesn't need a voice
+            voice = [end, loudness(note_info), note_info]
+            if len(playing) >= self.voices:
+                if self.steal == "oldest":
+                    stolen = playing[0]
+                else:
+                    stolen = min([*playing, voice], key=lambda voice: voice[1])
+                stolen[2]["stop"] = start
+                self.stolen += 1
+                if stolen is voice:
+                    continue
+                playing.remove(stolen)
+            playing.append(voice)
+        for grouped in group:
+            if grouped.get("stop") != group_start:
+                yield grouped
+
+# Seconds that stolen voices fade out over
+VOICE_RELEASE = 0.005
+
+def _release_voice(samples, stop):
+    # Returns the samples cut at stop and faded out after it
+    release = int(VOICE_RELEASE * s.RATE)
+    if len(samples) <= stop:
+        return samples
+    tail = samples[stop:stop + release]
+    return numpy.concatenate((
+        samples[:stop],
+        tail * numpy.linspace(1, 0, release, endpoint=False)[:len(tail)],
+    ))
+
+def mix_notes(
+    note_infos,
+    render,
+    *,
+    block_frames=25,
+    first_time=None,
+    start_sample=0,
+    stop_sample=None,
+):
+    """Mixes notes into chunks of 16-bit stereo 48kHz audio
+
+    Each note is rendered once into a NumPy array by render(note_info) and
+    added into a preallocated block at its sample offset. Blocks are
+    block_frames 20ms frames long and are yielded as 3840 byte chunks. Note
+    infos must be sorted by time, and sample 0 is at first_time (the first
+    note's time by default).
+
+    Only samples from start_sample up to stop_sample are mixed (both should
+    be on a frame). Notes that start before start_sample still count.
+
+    Notes with a "stop" sample (see VoiceAllocator) are faded out there. It
+    can be set while the note is playing, as long as it's before the block
+    it's in is mixed.
+
+    """
+    frame_size = s.RATE // 50
+    block_size = frame_size * block_frames
+    block = numpy.zeros(block_size)
+    output = numpy.empty((block_size, 2), dtype="<i2")
+    # Notes that are still playing as (start sample, samples, note info).
+    # The note info is None once a stolen note has been released.
+    active = []
+    note_infos = iter(note_infos)
+    pending = next(note_infos, None)
+    if first_time is None:
+        first_time = pending["time"] if pending is not None else 0
+    end = 0  # Sample where the last playing note ends
+    block_start = start_sample
+    while True:
+        if stop_sample is not None and block_start >= stop_sample:
+            return
+        block_end = block_start + block_size
+        if stop_sample is not None:
+            block_end = min(block_end, stop_sample)
+        # Render notes that start in this block
+        while pending is not None:
+            start = round((pending["time"] - first_time) * s.RATE)
+            if start >= block_end:
+                break
+            samples = render(pending)
+            if len(samples):
+                active.append((start, samples, pending))
+                end = max(end, start + len(samples))
+            pending = next(note_infos, None)
+        if pending is None and block_start >= end:
+            return
+        # Add the playing part of each note
+        block.fill(0.0)
+        playing = []
+        for start, samples, note_info in active:
+            if note_info is not None and "stop" in note_info:
+                samples = _release_voice(samples, note_info["stop"] - start)
+                note_info = None
+            low = max(start, block_start)
+            high = min(start + len(samples), block_end)
+            # Segments can get notes that ended before them
+            if low < high:
+                block[low - block_start:high - block_start] += (
+                    samples[low - start:high - start]
+                )
+            if start + len(samples) > block_end:
+                playing.append((start, samples, note_info))
+        active = playing
+        # Convert to 16-bit stereo (the float to int cast truncates like
+        # soundit's chunked does)
+        block *= 32768
+        numpy.clip(block, -32768, 32767, out=block)
+        output[:, 0] = block
+        output[:, 1] = block
+        # The last block only goes up to the end of the last frame
+        size = block_end - block_start
+        if pending is None and end < block_end:
+            size = -(-(end - block_start) // frame_size) * frame_size
+        data = memoryview(output[:size]).cast("B")
+        for i in range(0, len(data), frame_size * 4):
+            yield bytes(data[i:i + frame_size * 4])
+        block_start = block_end
+
+# Keyword arguments for make_sound in segment render workers
+_segment_kwargs = None
+
+def _init_segment_worker(kwargs):
+    global _segment_kwargs
+    # Kept between segments so that repeated pitches are reused
+    _segment_kwargs = dict(kwargs, resample_cache=ResampleCache())
+
+def _render_segment(note_infos, first_time, start_sample, stop_sample):
+    chunks = make_sound(
+        note_infos,
+        mix_blocks=True,
+        segment=(first_time, start_sample, stop_sample),
+        **_segment_kwargs,
+    )
+    return b"".join(chunks)
+
+def mix_segments(note_infos, span, *, workers, kwargs, segment_frames=500):
+    """Mixes notes like mix_notes but renders time segments in parallel
+
+    The timeline is split into segment_frames 20ms frame segments which are
+    mixed by a pool of worker processes, each calling make_sound(**kwargs).
+    span(note_info) is an upper bound on how many samples a note plays for,
+    so that notes crossing into later segments are also mixed there. Every
+    sample sums the same notes in the same order as mix_notes does, so the
+    output is identical. Segments are yielded in order as 3840 byte chunks,
+    with at most 2 segments per worker rendered ahead.
+
+    """
+    frame_size = s.RATE // 50
+    chunk_size = frame_size * 4
+    segment_size = frame_size * segment_frames
+    note_infos = list(note_infos)
+    if not note_infos:
+        return
+    first_time = note_infos[0]["time"]
+    # Note infos playing during each segment
+    segments = []
+    for note_info in note_infos:
+        start = round((note_info["time"] - first_time) * s.RATE)
+        end = start + span(note_info)
+        first = start // segment_size
+        last = max(first, (end - 1) // segment_size)
+        while len(segments) <= last:
+            segments.append([])
+        for i in range(first, last + 1):
+            segments[i].append(note_info)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_segment_worker,
+        initargs=(kwargs,),
+    )
+    futures = collections.deque()
+    submitted = 0
+    # Silent chunks after the last note so far. They're only yielded if a
+    # later segment plays something.
+    silence = 0
+    try:
+        for i in range(len(segments)):
+            while submitted < len(segments) and submitted < i + 2 * workers:
+                segment = segments[submitted]
+                future = None
+                if segment:
+                    future = executor.submit(
+                        _render_segment,
+                        segment,
+                        first_time,
+                        submitted * segment_size,
+                        (submitted + 1) * segment_size,
+                    )
+                futures.append(future)
+                submitted += 1
+            future = futures.popleft()
+            data = future.result() if future is not None else b""
+            if data:
+                for _ in range(silence):
+                    yield bytes(chunk_size)
+                silence = 0
+                for j in range(0, len(data), chunk_size):
+                    yield data[j:j + chunk_size]
+            silence += (segment_size * 4 - len(data)) // chunk_size
+    finally:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        executor.shutdown()
+
+def make_sound(
+    note_infos,
+    *,
+    settings,
+    template,
+    cache=None,
+    timings=None,
+    mix_blocks=False,
+    resampler="linear",
+    resample_cache=None,
+    workers=1,
+    segment=None,
+    voices=None,
+):
+    """Generate a sound from note infos
+
+    If timings is a dict, the seconds spent loading instrument samples are
+    added to timings["sample load"].
+
+    If mix_blocks is True (needs NumPy), each note is rendered once and
+    mixed in blocks, and 3840 byte chunks are returned instead of a sound.
+    Detuned notes are then resampled with the resampler method (see
+    resample) and kept in resample_cache (a new ResampleCache by default).
+    If workers is more than 1, time segments are mixed in that many processes
+    (see mix_segments). segment is (first_time, start_sample, stop_sample)
+    for only mixing one segment (see mix_notes). voices is a VoiceAllocator
+    to cap how many notes play at once.
+
+    """
 
     # Cached to be a tad bit faster (removes float conversion step)
     @s.lru_iter_cache(maxsize=16)
@@ -25,6 +541,14 @@ def make_sound(note_infos, *, settings, template, cache=None):
     # Cached so that we don't start up 2000 FFmpeg processes
     @s.lru_iter_cache(cache=cache)
     def instrument_chunks_at(instrument, note_index):
+        chunks = load_instrument_chunks(instrument, note_index)
+        if timings is None:
+            return chunks
+        return _timed(chunks, timings, "sample load")
+
+    # Returns the audio file and the section (start and length in seconds)
+    # holding the instrument's note
+    def section_of(instrument, note_index):
         filename = template.replace("<>", str(instrument))
         if settings["originalBpm"][instrument] != 0:
             length = 60 / (settings["originalBpm"][instrument] * 2)
@@ -39,6 +563,10 @@ def make_sound(note_infos, *, settings, template, cache=None):
                     length = sample_lengths["-1"]
             start = note_index * length
         length -= 0.005  # Some files have noise at the end
+        return filename, start, length
+
+    def load_instrument_chunks(instrument, note_index):
+        filename, start, length = section_of(instrument, note_index)
         if not getattr(s, "has_av", False) or not hasattr(s, "file_chunks"):
             args = s.make_ffmpeg_section_args(filename, start, length)
             if "-nostdin" not in args:
@@ -76,26 +604,25 @@ def make_sound(note_infos, *, settings, template, cache=None):
     else:
         all_note_infos = []
         if first_note_info is not None:
-            note_infos.append(first_note_info)
+            all_note_infos.append(first_note_info)
         all_note_infos.extend(note_infos)
-        note_infos = sorted(note_infos, key=lambda info: info["time"])
+        note_infos = sorted(all_note_infos, key=lambda info: info["time"])
 
     # Mapping between note types (A5, F#3) to note indices (69, 42)
     note_indices = s.make_indices_dict()
     note_indices["c8"] = note_indices["b7"] + 1  # Sometimes is a sample note
 
-    # Helper function for getting each note's sound
-    def sound_for(note_info):
+    # Returns (instrument, note_index, volume, detune, length, fade_time) for
+    # a sampled instrument's note, or None if the note should be skipped
+    def sample_params_for(note_info):
         instrument = note_info["instrument"] % 10000
         note_index = note_indices[note_info["type"].lower()]
-        if 13 <= instrument <= 16:
-            return synth_sound_for(note_info)
         # Skip unknown instruments
         if instrument >= len(settings["volume"]):
-            return s.passed(0)
+            return None
         # Skip the custom synth
         if instrument == 55:
-            return s.passed(0)
+            return None
         length = note_info["length"]
         fade_time = 0
         if str(instrument) in settings.get("kSampleMap", ()):
@@ -106,7 +633,7 @@ def make_sound(note_infos, *, settings, template, cache=None):
         if str(instrument) in settings.get("kSampleMap", ()):
             # Skip sampled instruments if soundit can't resample
             if not hasattr(s, "_resample_linear"):
-                return s.passed(0)
+                return None
             sample_notes = settings["kSampleMap"][str(instrument)]
             if note_info["type"] in sample_notes:
                 note_index = sample_notes.index(note_info["type"])
@@ -119,11 +646,22 @@ def make_sound(note_infos, *, settings, template, cache=None):
                 # We want to resample more frequently if too high, vice versa
                 note_index = sample_notes.index(sample_note)
                 detune += semitones_off*100
+        volume = settings["volume"][instrument] * note_info["volume"]
+        return instrument, note_index, volume, detune, length, fade_time
+
+    # Helper function for getting each note's sound
+    def sound_for(note_info):
+        instrument = note_info["instrument"] % 10000
+        if 13 <= instrument <= 16:
+            return synth_sound_for(note_info)
+        params = sample_params_for(note_info)
+        if params is None:
+            return s.passed(0)
+        instrument, note_index, volume, detune, length, fade_time = params
         sound = instrument_sound_at(
             instrument,
             note_index,
         )
-        volume = settings["volume"][instrument] * note_info["volume"]
         if volume != 1:
             sound = s.volume(volume, sound)
         if detune != 0:
@@ -133,11 +671,82 @@ def make_sound(note_infos, *, settings, template, cache=None):
             sound = s.fade(sound, fadein=0, fadeout=fade_time)
         return sound
 
+    # Memory-mapped sample banks by filename (see
+    # online_sequencer_sample_bank.py)
+    banks = {}
+
+    # Each sampled note as a read only view into its sample bank for the
+    # block mixer
+    def instrument_samples_at(instrument, note_index):
+        filename, start, length = section_of(instrument, note_index)
+        samples = banks.get(filename)
+        if samples is None:
+            load_start = time.perf_counter()
+            samples = banks[filename] = sample_bank.load(filename)
+            if timings is not None:
+                timings["sample load"] = (
+                    timings.get("sample load", 0)
+                    + time.perf_counter() - load_start
+                )
+        start = max(0, round(start * s.RATE))
+        return samples[start:start + round(length * s.RATE)]
+
+    # Returns at least count samples of the note resampled by detune cents.
+    # Repeated pitches are only resampled once.
+    if resample_cache is None and mix_blocks:
+        resample_cache = ResampleCache()
+    def resampled_samples_at(instrument, note_index, detune, count):
+        def make(count):
+            samples = instrument_samples_at(instrument, note_index)
+            factor = 2**(detune/100/12)
+            total = int((len(samples) - 1) / factor) + 1 if len(samples) else 0
+            count = min(total, max(count, 4 * s.RATE))  # Make a bit extra
+            return (
+                resample(samples, factor, count=count, method=resampler),
+                count == total,
+            )
+        return resample_cache.get((instrument, note_index, detune), count, make)
+
+    # Helper function for rendering each note's samples for the block mixer.
+    # Same as sound_for but with whole arrays.
+    def render_note(note_info):
+        instrument = note_info["instrument"] % 10000
+        if 13 <= instrument <= 16:
+            return render_synth_note(note_info)
+        params = sample_params_for(note_info)
+        if params is None:
+            return numpy.zeros(0)
+        instrument, note_index, volume, detune, length, fade_time = params
+        # Sounds with a fade are cut after it. Others play to the end.
+        count = None
+        if fade_time != 0:
+            count = int((length + fade_time) * s.RATE)
+        if detune != 0:
+            samples = resampled_samples_at(
+                instrument,
+                note_index,
+                detune,
+                count if count is not None else float("inf"),
+            )
+        else:
+            samples = instrument_samples_at(instrument, note_index)
+        if count is not None:
+            samples = samples[:count]
+        # Also copies the bank's read only view
+        samples = samples * volume
+        if fade_time != 0:
+            fadeout = int(fade_time * s.RATE)
+            if fadeout:
+                fade = numpy.arange(len(samples), 0, -1) / fadeout
+                samples *= fade.clip(0, 1)
+        return samples
+
     # Mapping from note types to frequencies
     frequencies = s.make_frequencies_dict()
 
     synths_take_seconds = "seconds" in inspect.signature(s.sine).parameters
-    def synth_sound_for(note_info):
+    # Returns (instrument, freq, length, volume) for a synth note
+    def synth_params_for(note_info):
         # 13=sine, 14=square, 15=sawtooth, 16=triangle
         instrument = note_info["instrument"] % 10000
         assert 13 <= instrument <= 16
@@ -153,21 +762,66 @@ def make_sound(note_infos, *, settings, template, cache=None):
         freq = frequencies[note_index - settings["min"][instrument]]
         if detune != 0:
             freq *= 2**(detune/100/12)
-        func = (s.sine, s.square, s.sawtooth, s.triangle)[instrument - 13]
-        if synths_take_seconds:
-            sound = func(freq, seconds=length)
-        else:  # Newer soundit versions don't have the seconds arg
-            sound = s.cut(length, func(freq))
 
         volume = settings["volume"][instrument] * note_info["volume"]
         if instrument == 14:
             # Square waves are between -0.5 and 0.5 in OSeq
             volume *= 0.5
+
+        return instrument, freq, length, volume
+
+    def synth_sound_for(note_info):
+        instrument, freq, length, volume = synth_params_for(note_info)
+        func = (s.sine, s.square, s.sawtooth, s.triangle)[instrument - 13]
+        if synths_take_seconds:
+            sound = func(freq, seconds=length)
+        else:  # Newer soundit versions don't have the seconds arg
+            sound = s.cut(length, func(freq))
         if volume != 1:
             sound = s.volume(volume, sound)
-
         return s.fade(sound)
 
+    # Same as synth_sound_for but renders the whole note from a wavetable
+    def render_synth_note(note_info):
+        instrument, freq, length, volume = synth_params_for(note_info)
+        return synth_note(
+            WAVEFORMS[instrument - 13],
+            freq,
+            int(length * s.RATE),
+            volume,
+        )
+
+    # Upper bound on how many samples render_note makes for a note, without
+    # loading or rendering anything
+    def note_span(note_info):
+        instrument = note_info["instrument"] % 10000
+        if 13 <= instrument <= 16:
+            _, _, length, _ = synth_params_for(note_info)
+            return int(length * s.RATE)
+        params = sample_params_for(note_info)
+        if params is None:
+            return 0
+        instrument, note_index, _, detune, length, fade_time = params
+        _, _, section_length = section_of(instrument, note_index)
+        count = max(0, round(section_length * s.RATE))
+        if detune != 0 and count:
+            count = int((count - 1) / 2**(detune/100/12)) + 1
+        if fade_time != 0:
+            count = min(count, int((length + fade_time) * s.RATE))
+        return count
+
+    # Volume of a note for stealing the quietest voices
+    def note_loudness(note_info):
+        instrument = note_info["instrument"] % 10000
+        if 13 <= instrument <= 16:
+            _, _, _, volume = synth_params_for(note_info)
+            return volume
+        params = sample_params_for(note_info)
+        if params is None:
+            return 0
+        _, _, volume, _, _, _ = params
+        return volume
+
     # Create notes of the form (info, length). Note that length is how many
     # seconds later the next node should start playing.
     def _notes_generator(note_infos):
@@ -179,6 +833,33 @@ def make_sound(note_infos, *, settings, template, cache=None):
                 last_time = note_info["time"]
             yield (note_info, 0)
 
+    if mix_blocks:
+        if voices is not None and segment is None:
+            note_infos = voices.allocate(
+                note_infos,
+                span=note_span,
+                loudness=note_loudness,
+            )
+        if workers > 1 and segment is None:
+            return mix_segments(
+                note_infos,
+                note_span,
+                workers=workers,
+                kwargs=dict(
+                    settings=settings,
+                    template=template,
+                    resampler=resampler,
+                ),
+            )
+        first_time, start_sample, stop_sample = segment or (None, 0, None)
+        return mix_notes(
+            note_infos,
+            render_note,
+            first_time=first_time,
+            start_sample=start_sample,
+            stop_sample=stop_sample,
+        )
+
     if hasattr(s, "_notes_to_sound"):
         # Stable enough for our use (and also supports numpy)
         notes_to_sound = s._notes_to_sound
@@ -207,37 +888,129 @@ def make_sound(note_infos, *, settings, template, cache=None):
 def _stream_read_json_array(next_func):
     # Calls next_func for more bytes from the stream, should return empty
     # bytes on EOF. Yields elements of an array.
-    data = bytearray()
-    chars = next_func()
-    data += chars
-    i = 0
-    def recall(read_func):
-        nonlocal i
-        while True:
-            try:
-                return read_func()
-            except (IndexError, ValueError):
-                chars = next_func()
-                if not chars:
-                    raise ValueError("unexpected EOF while parsing JSON")
-                del data[:i]
-                i = 0
-                data.extend(chars)
-    i, first_char = recall(lambda: jf.read_tag(data, i))
-    if first_char != b"["[0]:
-        raise ValueError("expected JSON note infos")
-    _, first_char = recall(lambda: jf.read_tag(data, i))
-    if first_char == b"]"[0]:
-        return
-    while True:
-        j, first_char, start = recall(lambda: jf.read(data, i))
-        assert first_char not in b",]", first_char
-        yield json.loads(data[i:j].decode())
-        i = j
-        i, split_char = recall(lambda: jf.read_tag(data, i))
-        assert split_char in b",:]}", split_char
-        if split_char == b"]"[0]:
-            break
+    parser = jf.ArrayParser()
+    while not parser.done:
+        chars = next_func()
+        if not chars:
+            parser.close()
+        for element in parser.feed(chars):
+            yield json.loads(element)
+
+def _read_sequence_note_infos(data):
+    # Needs the Online Sequencer requirements, so only imported when used
+    import online_sequencer_get_note_infos as os_note_infos
+    return os_note_infos._get_notes(data)
+
+def _peak_memory():
+    # Returns the peak resident memory in bytes or None if unknown
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _open_output(path):
+    # Returns functions to write PCM to the file and to close it. WAV files
+    # are written directly and anything else is encoded by FFmpeg.
+    if path.lower().endswith(".wav"):
+        file = wave.open(path, "wb")
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(48000)
+        return file.writeframesraw, file.close
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+            "-f", "s16le", "-ar", "48000", "-ac", "2", "-i", "-",
+            path,
+        ],
+        stdin=subprocess.PIPE,
+    )
+    def close():
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"FFmpeg exited with code {process.returncode}")
+    return process.stdin.write, close
+
+def render_file(note_infos, output, *, settings, template, **kwargs):
+    """Renders note infos into an audio file
+
+    Returns a dict with the seconds of audio, the seconds taken by each stage
+    (parse, sample load, mix and write), the peak memory in bytes and the
+    ResampleCache used (None without NumPy or with workers, where each worker
+    has its own and sample loads count as mixing). The VoiceAllocator passed
+    as voices (if any) is also returned.
+
+    """
+    timings = {}
+    start = time.perf_counter()
+    note_infos = list(note_infos)
+    timings["parse"] = time.perf_counter() - start
+    timings["sample load"] = 0
+    timings["write"] = 0
+    resample_cache = None
+    if _can_mix_blocks() and kwargs.get("workers", 1) <= 1:
+        resample_cache = kwargs.setdefault("resample_cache", ResampleCache())
+    write, close = _open_output(output)
+    size = 0
+    start = time.perf_counter()
+    try:
+        for chunk in make_chunks(
+            note_infos,
+            settings=settings,
+            template=template,
+            timings=timings,
+            **kwargs,
+        ):
+            write_start = time.perf_counter()
+            write(chunk)
+            timings["write"] += time.perf_counter() - write_start
+            size += len(chunk)
+    finally:
+        write_start = time.perf_counter()
+        close()
+        timings["write"] += time.perf_counter() - write_start
+    total = time.perf_counter() - start
+    timings["mix"] = total - timings["sample load"] - timings["write"]
+    return {
+        "notes": len(note_infos),
+        "seconds": size / (48000 * 2 * 2),
+        "timings": timings,
+        "peak_memory": _peak_memory(),
+        "resample_cache": resample_cache,
+        "voices": kwargs.get("voices"),
+    }
+
+def _print_report(report, *, file=sys.stderr):
+    timings = report["timings"]
+    for name in ("parse", "sample load", "mix", "write"):
+        print(f"{name:>12}: {timings[name]:8.3f}s", file=file)
+    render = timings["sample load"] + timings["mix"] + timings["write"]
+    speed = report["seconds"] / render if render else float("inf")
+    print(
+        f"Rendered {report['notes']} notes into {report['seconds']:.1f}s of"
+        f" audio in {render:.3f}s ({speed:.1f}x realtime)",
+        file=file,
+    )
+    cache = report["resample_cache"]
+    if cache is not None:
+        print(
+            f"Resampled notes: {cache.misses} resampled, {cache.hits} reused",
+            file=file,
+        )
+    voices = report["voices"]
+    if voices is not None:
+        print(
+            f"Stolen voices: {voices.stolen} (at most {voices.voices},"
+            f" {voices.steal} first)",
+            file=file,
+        )
+    if report["peak_memory"] is None:
+        print("Peak memory: unknown", file=file)
+    else:
+        print(f"Peak memory: {report['peak_memory'] / 2**20:.1f}MB", file=file)
 
 parser = argparse.ArgumentParser(
     description="Generates PCM 16-bit 48kHz sound from note infos in stdin.",
@@ -252,16 +1025,94 @@ parser.add_argument(
     default="oscollection/<>.ogg",
     help="template to Online Sequencer audio files",
 )
+parser.add_argument(
+    "--format",
+    choices=(*ns.FORMATS, "sequence"),
+    default="json",
+    help=(
+        "format of the note infos (default is json). sequence is the raw"
+        " protobuf data of an Online Sequencer sequence"
+    ),
+)
+parser.add_argument(
+    "--resampler",
+    choices=RESAMPLERS,
+    default="linear",
+    help="how detuned notes are resampled when NumPy is used (default is linear)",
+)
+parser.add_argument(
+    "--voices",
+    type=int,
+    default=0,
+    help=(
+        "most notes that can play at once when NumPy is used (default is 0"
+        " for no limit)"
+    ),
+)
+parser.add_argument(
+    "--steal",
+    choices=VoiceAllocator.STEAL,
+    default="oldest",
+    help="which notes are stopped when there are too many (default is oldest)",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help=(
+        "render time segments in this many processes when NumPy is used"
+        " (default is 1, 0 uses every CPU core)"
+    ),
+)
+parser.add_argument(
+    "--input",
+    help="file to read note infos from instead of stdin",
+)
+parser.add_argument(
+    "--output",
+    help=(
+        "render to this WAV file (or any format FFmpeg can write, like OGG)"
+        " instead of stdout and print timings"
+    ),
+)
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+    voices = None
+    if args.voices > 0:
+        voices = VoiceAllocator(args.voices, steal=args.steal)
     with open(args.settings) as file:
         settings = json.load(file)
-    infos = _stream_read_json_array(lambda: sys.stdin.buffer.read(2048))
-    chunks = make_chunks(
-        infos,
-        settings=settings,
-        template=args.template,
-    )
-    for chunk in chunks:
-        sys.stdout.buffer.write(chunk)
+    if args.input is None:
+        stream = sys.stdin.buffer
+    else:
+        stream = open(args.input, "rb")
+    if args.format == "sequence":
+        infos = _read_sequence_note_infos(stream.read())
+    elif args.format == "binary":
+        infos = ns.read_note_infos(stream.read)
+    else:
+        infos = _stream_read_json_array(lambda: stream.read(2048))
+    if args.output is not None:
+        report = render_file(
+            infos,
+            args.output,
+            settings=settings,
+            template=args.template,
+            resampler=args.resampler,
+            workers=workers,
+            voices=voices,
+        )
+        _print_report(report)
+    else:
+        chunks = make_chunks(
+            infos,
+            settings=settings,
+            template=args.template,
+            resampler=args.resampler,
+            workers=workers,
+            voices=voices,
+        )
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
@@ -0,0 +1,126 @@
+"""Wire formats for sending note infos to online_sequencer_make_chunks.py
+
+The JSON format is a JSON array of note info objects. It's easy to debug but
+every note is dumped and then parsed again on the other side.
+
+The binary format sends notes in batches. Each batch starts with the number of
+notes in it as a 4 byte little endian unsigned integer, followed by that many
+fixed size records (see RECORD). A batch with 0 notes ends the stream.
+
+Each record holds:
+    instrument: 4 byte signed integer
+    type: note index, where C0 = 0, C#0 = 1, ..., B8 = 107
+    flags: 1 if the note infos are sorted by time (only on the first note)
+    time, length, volume, detune: 8 byte floats
+
+Example:
+    >>> import io
+    >>> file = io.BytesIO()
+    >>> infos = [{"instrument": 1, "type": "C#4", "time": 0.5, "length": 0.25,
+    ...           "volume": 1, "detune": 0, "sorted": 1}]
+    >>> write_note_infos(file.write, infos)
+    >>> file.seek(0)
+    0
+    >>> list(read_note_infos(file.read))
+    [{'instrument': 1, 'type': 'C#4', 'time': 0.5, 'length': 0.25, 'volume': 1.0, 'detune': 0.0, 'sorted': 1}]
+
+"""
+import json
+import struct
+from typing import Callable, Iterable, Iterator
+
+FORMATS = ("json", "binary")
+
+COUNT = struct.Struct("<I")
+RECORD = struct.Struct("<iBBdddd")
+
+FLAG_SORTED = 1
+
+# Note types by index and the reverse
+NOTE_TYPES = [
+    f"{note}{octave}"
+    for octave in range(9)
+    for note in "C C# D D# E F F# G G# A A# B".split()
+]
+NOTE_TYPE_INDICES = {note_type: i for i, note_type in enumerate(NOTE_TYPES)}
+
+# - Binary
+
+def write_note_infos(
+    write: Callable[[bytes], object],
+    note_infos: Iterable[dict],
+    *,
+    batch_size: int = 1024,
+) -> None:
+    """Writes note infos in the binary format using write"""
+    pack_into = RECORD.pack_into
+    size = RECORD.size
+    batch = bytearray(COUNT.size + size * batch_size)
+    count = 0
+    for note_info in note_infos:
+        pack_into(
+            batch,
+            COUNT.size + count * size,
+            note_info["instrument"],
+            NOTE_TYPE_INDICES[note_info["type"]],
+            FLAG_SORTED if note_info.get("sorted") else 0,
+            note_info["time"],
+            note_info["length"],
+            note_info["volume"],
+            note_info.get("detune", 0),
+        )
+        count += 1
+        if count == batch_size:
+            COUNT.pack_into(batch, 0, count)
+            write(bytes(batch))
+            count = 0
+    if count:
+        COUNT.pack_into(batch, 0, count)
+        write(bytes(batch[:COUNT.size + count * size]))
+    write(COUNT.pack(0))
+
+def _read_exactly(read: Callable[[int], bytes], size: int) -> bytes:
+    data = read(size)
+    while len(data) < size:
+        more = read(size - len(data))
+        if not more:
+            raise ValueError("unexpected EOF while reading note infos")
+        data += more
+    return data
+
+def read_note_infos(read: Callable[[int], bytes]) -> Iterator[dict]:
+    """Yields note infos in the binary format read using read(size)"""
+    note_types = NOTE_TYPES
+    while True:
+        count, = COUNT.unpack(_read_exactly(read, COUNT.size))
+        if count == 0:
+            return
+        batch = _read_exactly(read, count * RECORD.size)
+        for (
+            instrument, type_, flags, time, length, volume, detune,
+        ) in RECORD.iter_unpack(batch):
+            note_info = {
+                "instrument": instrument,
+                "type": note_types[type_],
+                "time": time,
+                "length": length,
+                "volume": volume,
+                "detune": detune,
+            }
+            if flags & FLAG_SORTED:
+                note_info["sorted"] = 1
+            yield note_info
+
+# - JSON
+
+def write_note_infos_json(
+    write: Callable[[bytes], object],
+    note_infos: Iterable[dict],
+) -> None:
+    """Writes note infos as a JSON array using write"""
+    write(b"[")
+    for i, note_info in enumerate(note_infos):
+        if i != 0:
+            write(b",")
+        write(json.dumps(note_info).encode())
+    write(b"]")
@@ -0,0 +1,93 @@
+"""Pre-decoded instrument sample bank for Online Sequencer
+
+Each instrument's audio file (like oscollection/3.ogg) is decoded once into a
+.npy file next to it (oscollection/3.npy) holding its 48kHz mono samples as
+32-bit floats in [-1, 1). Renders memory-map these files and slice each note's
+section as a zero-copy view, so rendering a song doesn't decode anything.
+
+Banks are built on first use, or ahead of time with:
+
+    python online_sequencer_sample_bank.py oscollection
+
+A bank is rebuilt if its audio file is newer than it.
+
+"""
+import argparse
+import glob
+import os
+
+import numpy
+import soundit as s
+
+def bank_filename(filename: str) -> str:
+    """Returns the .npy filename for an instrument's audio file"""
+    return os.path.splitext(filename)[0] + ".npy"
+
+def _decode_chunks(filename):
+    if getattr(s, "has_av", False) and hasattr(s, "_chunked_libav_section"):
+        return s._chunked_libav_section(filename, 0, None)
+    args = s.make_ffmpeg_section_args(filename, 0, None)
+    if "-nostdin" not in args:
+        args = ["-nostdin", *args]
+    return s.chunked_ffmpeg_process(s.create_ffmpeg_process(*args))
+
+def decode(filename: str) -> numpy.ndarray:
+    """Decodes the whole audio file into mono float32 samples"""
+    data = b"".join(map(bytes, _decode_chunks(filename)))
+    stereo = numpy.frombuffer(data, dtype="<i2", count=len(data) // 4 * 2)
+    stereo = stereo.reshape(-1, 2).astype(numpy.float32)
+    mono = stereo[:, 0] + stereo[:, 1]
+    mono /= 2 * 32768
+    return mono
+
+def _is_stale(filename: str, path: str) -> bool:
+    try:
+        built = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return True
+    return os.stat(filename).st_mtime_ns > built
+
+def build(filename: str, *, force: bool = False) -> str:
+    """Decodes the audio file into its bank if needed and returns the bank's
+    path"""
+    path = bank_filename(filename)
+    if not force and not _is_stale(filename, path):
+        return path
+    samples = decode(filename)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        numpy.save(file, samples)
+    os.replace(temp_path, path)
+    return path
+
+def load(filename: str) -> numpy.ndarray:
+    """Returns a read only memory-mapped array of the audio file's samples"""
+    return numpy.load(build(filename), mmap_mode="r")
+
+def build_directory(directory: str, *, force: bool = False) -> int:
+    """Builds banks for every .ogg file in the directory and returns how
+    many there are"""
+    filenames = sorted(glob.glob(os.path.join(glob.escape(directory), "*.ogg")))
+    for filename in filenames:
+        build(filename, force=force)
+    return len(filenames)
+
+parser = argparse.ArgumentParser(
+    description="Decodes Online Sequencer instrument audio into sample banks.",
+)
+parser.add_argument(
+    "directory",
+    nargs="?",
+    default="oscollection",
+    help="directory with the instrument audio files (default is oscollection)",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="rebuild banks even if they're up to date",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    count = build_directory(args.directory, force=args.force)
+    print(f"Built sample banks for {count} instruments")
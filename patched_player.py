@@ -1,4 +1,4 @@
-"""Provides a better FFmpeg PCM audio source
+"""Provides better FFmpeg PCM and Opus audio sources and volume control
 
 The builtin class passes creationflags=CREATE_NO_WINDOW to the subprocess. I'm
 not entirely sure why this slows down the process's creation. I am sure that,
@@ -9,17 +9,30 @@ If, for some reason, each FFmpeg subprocess is actually making a window, you
 can pass creationflags=subprocess.CREATE_NO_WINDOW to the constructor to set it
 again.
 
+The builtin PCMVolumeTransformer uses audioop (removed in Python 3.13) and
+jumps straight to a new volume, which can click. The PCMVolumeTransformer here
+scales each frame with NumPy into reused buffers and ramps between volumes.
+Without NumPy, it falls back to a slower pure Python loop.
+
 Source code is adapted from discord/player.py.
 
 """
 import sys
+import array
 import subprocess
 
 import discord
 
-__all__ = ("FFmpegPCMAudio",)
+try:
+    import numpy
+except ImportError:
+    has_numpy = False
+else:
+    has_numpy = True
+
+__all__ = ("FFmpegPCMAudio", "FFmpegOpusAudio", "PCMVolumeTransformer", "opus_codec")
 
-class FFmpegPCMAudio(discord.FFmpegPCMAudio):
+class _PatchedSpawnMixin:
 
     # Default is 0 for no flags (used to be subprocess.CREATE_NO_WINDOW). See
     # the documentation for discord.FFmpegPCMAudio for more info on kwargs.
@@ -46,3 +59,126 @@ class FFmpegPCMAudio(discord.FFmpegPCMAudio):
         except subprocess.SubprocessError as exc:
             message = f"Popen failed: {type(exc).__name__}: {exc}"
             raise discord.ClientException(message) from exc
+
+class FFmpegPCMAudio(_PatchedSpawnMixin, discord.FFmpegPCMAudio):
+    pass
+
+# Sends Opus packets straight from FFmpeg. If the input is already Opus, pass
+# codec=opus_codec(acodec) (or use from_probe) so it isn't re-encoded.
+class FFmpegOpusAudio(_PatchedSpawnMixin, discord.FFmpegOpusAudio):
+    pass
+
+def opus_codec(acodec):
+    """Returns the codec to pass to FFmpegOpusAudio for an input codec
+
+    discord.py turns both "opus" and "libopus" into -c:a copy (older versions
+    encode on "copy"), so only Opus input gets a codec. Anything else gets
+    None, which has FFmpeg encode it with libopus.
+
+    >>> opus_codec("opus")
+    'opus'
+    >>> opus_codec("mp4a.40.2") is None
+    True
+    >>> [opus_codec(acodec) for acodec in ("aac", "vorbis", "mp3", None)]
+    [None, None, None, None]
+
+    """
+    if acodec == "opus":
+        return "opus"
+    return None
+
+class PCMVolumeTransformer(discord.PCMVolumeTransformer):
+
+    # Same limit as the builtin transformer
+    MAX_VOLUME = 2.0
+    # 20ms of 16-bit stereo 48kHz audio
+    FRAME_SAMPLES = 960 * 2
+
+    # When the volume changes, the gain moves to the new volume linearly over
+    # ramp_frames frames (20ms each) instead of jumping.
+    def __init__(self, original, volume=1.0, *, ramp_frames=5):
+        self.ramp_frames = ramp_frames
+        self._gain = min(max(volume, 0.0), self.MAX_VOLUME)
+        self._ramp_left = 0
+        if has_numpy:
+            self._buffer = numpy.empty(self.FRAME_SAMPLES, dtype=numpy.float32)
+            self._output = numpy.empty(self.FRAME_SAMPLES, dtype="<i2")
+            self._ramp = None
+        super().__init__(original, volume)
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(value, 0.0)
+        self._ramp_left = self.ramp_frames
+
+    # Returns the gain at the start and end of this frame
+    def _next_gains(self):
+        target = min(self._volume, self.MAX_VOLUME)
+        start = self._gain
+        if self._ramp_left <= 1 or start == target:
+            self._ramp_left = 0
+            self._gain = target
+        else:
+            self._gain += (target - start) / self._ramp_left
+            self._ramp_left -= 1
+        return start, self._gain
+
+    def read(self):
+        data = self.original.read()
+        if not data:
+            return data
+        start, end = self._next_gains()
+        if start == end == 1.0:
+            # The Opus encoder needs bytes, not a view of someone's buffer
+            return data if isinstance(data, bytes) else bytes(data)
+        if not has_numpy:
+            return self._read_python(data, start, end)
+        size = len(data) // 2
+        if size > len(self._buffer):
+            self._buffer = numpy.empty(size, dtype=numpy.float32)
+            self._output = numpy.empty(size, dtype="<i2")
+            self._ramp = None
+        samples = numpy.frombuffer(data, dtype="<i2", count=size)
+        output = self._output[:size]
+        if start == end and start <= 1.0:
+            # Can't overflow so the product goes straight into the output
+            numpy.multiply(samples, numpy.float32(start), out=output, casting="unsafe")
+            return output.tobytes()
+        buffer = self._buffer[:size]
+        if start == end:
+            numpy.multiply(samples, numpy.float32(start), out=buffer)
+        else:
+            # Both channels of a sample get the same gain
+            pairs = size // 2
+            if self._ramp is None or len(self._ramp) != pairs:
+                self._ramp = numpy.arange(pairs, dtype=numpy.float32) / pairs
+            gains = self._ramp * numpy.float32(end - start)
+            gains += numpy.float32(start)
+            numpy.multiply(
+                samples[:pairs * 2].reshape(-1, 2),
+                gains[:, None],
+                out=buffer[:pairs * 2].reshape(-1, 2),
+            )
+            buffer[pairs * 2:] = 0
+        if max(start, end) > 1.0:
+            numpy.clip(buffer, -32768, 32767, out=buffer)
+        output[:] = buffer
+        return output.tobytes()
+
+    def _read_python(self, data, start, end):
+        samples = array.array("h")
+        samples.frombytes(data[:len(data) // 2 * 2])
+        if sys.byteorder != "little":
+            samples.byteswap()
+        count = len(samples) // 2 or 1
+        step = (end - start) / count
+        for i, sample in enumerate(samples):
+            value = int(sample * (start + step * (i // 2)))
+            samples[i] = -32768 if value < -32768 else 32767 if value > 32767 else value
+        if sys.byteorder != "little":
+            samples.byteswap()
+        return samples.tobytes()
@@ -8,9 +8,10 @@ possible. This means that only the size of each field is decoded - the user can
 decode the actual field if they wish.
 
 A side effect of this design is that the schema is implicitly defined by the
-user's code. This improves performance at the cost of readability. In the
-future I may make it possible to have a simple schema to make reading nested
-fields easier.
+user's code. This improves performance at the cost of readability. When whole
+messages need decoding, compile_message turns a small schema into a decoder
+specialized for it (see the second example). MessageView goes the other way
+and only decodes the fields that are looked at.
 
 Example:
     data = open(..., mode="rb").read()
@@ -28,12 +29,41 @@ Example:
         elif wire_type == 5:
             print(f'{field}:I32 {int.from_bytes(data[value:i], "little")}i32')
 
+Example:
+    Point = compile_message("Point", [
+        Field(1, "x", "sint32"),
+        Field(2, "y", "sint32"),
+        Field(3, "tags", "string", repeated=True),
+    ])
+    point = Point.decode(data)  # Point(x=..., y=..., tags=[...])
+    x, y, tags = Point.decode_tuple(data)
+
+Every function here also takes a memoryview as data, in which case nothing is
+copied until a value is decoded.
+
 """
+import array
 import struct
-from typing import Any, Tuple, Iterator
+import sys
+from typing import Any, NamedTuple, Sequence, Tuple, Iterator
+
+try:
+    import numpy
+except ImportError:
+    has_numpy = False
+else:
+    has_numpy = True
+
+_unpack_float = struct.Struct("<f").unpack_from
+_unpack_double = struct.Struct("<d").unpack_from
 
 def read_varint(data: bytes, i: int) -> Tuple[int, int]:
-    k = r = 0
+    r = data[i]
+    if r < 128:  # Most varints are a single byte
+        return i + 1, r
+    r &= 0x7F
+    k = 7
+    i += 1
     while True:
         d = data[i]
         r += (d & 0x7F) << k
@@ -43,7 +73,11 @@ def read_varint(data: bytes, i: int) -> Tuple[int, int]:
         k += 7
 
 def read_tag(data: bytes, i: int) -> Tuple[int, int, int]:
-    i, tag = read_varint(data, i)
+    tag = data[i]
+    if tag < 128:
+        i += 1
+    else:
+        i, tag = read_varint(data, i)
     wire_type = tag & 0x07
     field = tag >> 3
     return i, field, wire_type
@@ -85,14 +119,561 @@ def skim(data: bytes, i: int, j: int) -> Iterator[Tuple[int, int, int, int]]:
 
 def to_float(data: bytes, i: int, j: int) -> float:
     assert i + 4 == j
-    return struct.unpack("<f", data[i:j])[0]
+    return _unpack_float(data, i)[0]
 
 def to_double(data: bytes, i: int, j: int) -> float:
     assert i + 8 == j
-    return struct.unpack("<d", data[i:j])[0]
+    return _unpack_double(data, i)[0]
+
+def to_sint(value: int) -> int:
+    """Decodes a zigzag encoded VARINT value (sint32 and sint64)"""
+    return (value >> 1) ^ -(value & 1)
+
+# - Packed repeated fields
+
+# Array typecodes for the values of each scalar type
+_ARRAY_TYPECODES = {
+    "int32": "q",
+    "int64": "q",
+    "uint32": "Q",
+    "uint64": "Q",
+    "sint32": "q",
+    "sint64": "q",
+    "bool": "b",
+    "enum": "q",
+    "fixed32": "I",
+    "sfixed32": "i",
+    "float": "f",
+    "fixed64": "Q",
+    "sfixed64": "q",
+    "double": "d",
+}
+
+def read_packed(data: bytes, i: int, j: int, type_: str) -> array.array:
+    """Decodes a packed repeated field of type_ values in data[i:j] into an
+    array"""
+    wire_type, _, _ = _SCALAR_TYPES[type_]
+    values = array.array(_ARRAY_TYPECODES[type_])
+    if wire_type in (1, 5):
+        if (j - i) % values.itemsize:
+            raise ValueError("packed field is truncated")
+        values.frombytes(memoryview(data)[i:j])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+    if wire_type != 0:
+        raise ValueError(f"{type_} fields can't be packed")
+    convert = _CONVERSIONS[type_]
+    append = values.append
+    while i < j:
+        value = data[i]
+        i += 1
+        if value >= 128:
+            i, value = read_varint(data, i - 1)
+        append(convert(value))
+    if i != j:
+        raise ValueError("packed field is truncated")
+    return values
+
+# NumPy dtypes for fixed width types
+_NUMPY_DTYPES = {
+    "fixed32": "<u4",
+    "sfixed32": "<i4",
+    "float": "<f4",
+    "fixed64": "<u8",
+    "sfixed64": "<i8",
+    "double": "<f8",
+}
+
+def read_packed_numpy(data: bytes, i: int, j: int, type_: str) -> "numpy.ndarray":
+    """Decodes a packed repeated field of type_ values in data[i:j] into a
+    NumPy array
+
+    Fixed width values are a read only view of data. VARINTs are decoded for
+    all values at once (as 64-bit integers, or booleans for bool).
+
+    """
+    if not has_numpy:
+        raise ImportError("NumPy is needed to read into NumPy arrays")
+    wire_type, _, _ = _SCALAR_TYPES[type_]
+    if wire_type in (1, 5):
+        dtype = numpy.dtype(_NUMPY_DTYPES[type_])
+        if (j - i) % dtype.itemsize:
+            raise ValueError("packed field is truncated")
+        return numpy.frombuffer(
+            data,
+            dtype=dtype,
+            count=(j - i) // dtype.itemsize,
+            offset=i,
+        )
+    if wire_type != 0:
+        raise ValueError(f"{type_} fields can't be packed")
+    raw = numpy.frombuffer(data, dtype=numpy.uint8, count=j - i, offset=i)
+    # Each VARINT ends with a byte under 128
+    ends = numpy.flatnonzero(raw < 128)
+    if len(raw) and (not len(ends) or ends[-1] != len(raw) - 1):
+        raise ValueError("packed field is truncated")
+    starts = numpy.zeros(len(ends), dtype=numpy.intp)
+    starts[1:] = ends[:-1] + 1
+    # How many bytes into its VARINT each byte is
+    places = numpy.arange(len(raw)) - numpy.repeat(starts, ends - starts + 1)
+    if len(places) and places.max() >= 10:
+        raise ValueError("VARINT is too long")
+    parts = (raw & 0x7F).astype(numpy.uint64) << (places * 7).astype(numpy.uint64)
+    if len(starts):
+        values = numpy.add.reduceat(parts, starts)
+    else:
+        values = numpy.zeros(0, dtype=numpy.uint64)
+    if type_ in ("uint32", "uint64"):
+        return values
+    if type_ == "bool":
+        return values != 0
+    if type_ in ("sint32", "sint64"):
+        values = (values >> numpy.uint64(1)) ^ (numpy.uint64(0) - (values & numpy.uint64(1)))
+    return values.view(numpy.int64)
+
+
+# - Schema compiled decoders
+
+# Wire type, struct format (fixed width types only) and an expression
+# converting the raw value for each scalar type
+_SCALAR_TYPES = {
+    "int32": (0, None, "value - 2**64 if value >= 2**63 else value"),
+    "int64": (0, None, "value - 2**64 if value >= 2**63 else value"),
+    "uint32": (0, None, "value"),
+    "uint64": (0, None, "value"),
+    "sint32": (0, None, "(value >> 1) ^ -(value & 1)"),
+    "sint64": (0, None, "(value >> 1) ^ -(value & 1)"),
+    "bool": (0, None, "value != 0"),
+    "enum": (0, None, "value - 2**64 if value >= 2**63 else value"),
+    "fixed32": (5, "<I", "value"),
+    "sfixed32": (5, "<i", "value"),
+    "float": (5, "<f", "value"),
+    "fixed64": (1, "<Q", "value"),
+    "sfixed64": (1, "<q", "value"),
+    "double": (1, "<d", "value"),
+    "string": (2, None, "str(value, 'utf-8')"),
+    "bytes": (2, None, "bytes(value)"),
+}
+
+_DEFAULTS = {"bool": False, "float": 0.0, "double": 0.0, "string": "", "bytes": b""}
+
+# Default of Field.default meaning the type's own default
+_TYPE_DEFAULT = object()
+
+class Field(NamedTuple):
+    """A field in a message schema for compile_message
+
+    type is the name of a scalar type (like "int32", "float" or "string") or
+    a message class made by compile_message. Repeated fields decode to lists
+    and can be packed or not. default is the value of a missing field (0, "",
+    etc. by default, and None for messages). Pass default=None to tell a
+    missing scalar apart from one that's 0.
+
+    >>> Pair = compile_message("Pair", [
+    ...     Field(1, "key", "int32", default=None),
+    ...     Field(2, "value", "int32"),
+    ... ])
+    >>> Pair.decode(b"\\x10\\x05")
+    Pair(key=None, value=5)
+    >>> Pair.decode(b"\\x08\\x00\\x10\\x05")
+    Pair(key=0, value=5)
+
+    """
+    number: int
+    name: str
+    type: Any
+    repeated: bool = False
+    default: Any = _TYPE_DEFAULT
+
+def _decode_packed(data, i, j, type_):
+    # Returns the values of a packed repeated scalar field as a list
+    values = read_packed(data, i, j, type_).tolist()
+    if type_ == "bool":
+        return [value != 0 for value in values]
+    return values
+
+_CONVERSIONS = {
+    type_: eval(f"lambda value: {conversion}")
+    for type_, (_, _, conversion) in _SCALAR_TYPES.items()
+}
+
+def _varint_lines(name, indent):
+    # Source reading a varint at data[i] into name, with a fast path for
+    # single byte varints
+    return [
+        f"{indent}{name} = data[i]",
+        f"{indent}i += 1",
+        f"{indent}if {name} >= 128:",
+        f"{indent}    i, {name} = read_varint(data, i - 1)",
+    ]
+
+def _decoder_source(fields, make, decode_attr):
+    # Source of a decode(data, i=0, j=None) function for the fields, which
+    # returns make(*values)
+    lines = [
+        "def decode(data, i=0, j=None):",
+        "    if j is None:",
+        "        j = len(data)",
+    ]
+    for index, field in enumerate(fields):
+        if field.repeated:
+            lines.append(f"    f{index} = []")
+        else:
+            lines.append(f"    f{index} = d{index}")
+    lines += [
+        "    while i < j:",
+        "        start = i",
+        *_varint_lines("tag", "        "),
+        "        if False:",
+        "            pass",
+    ]
+    for index, field in enumerate(fields):
+        target = f"f{index}"
+        store = (
+            (lambda value: f"{target}.append({value})") if field.repeated
+            else (lambda value: f"{target} = {value}")
+        )
+        if isinstance(field.type, str):
+            wire_type, fmt, conversion = _SCALAR_TYPES[field.type]
+        else:
+            wire_type, fmt, conversion = 2, None, None
+        lines.append(f"        elif tag == {field.number << 3 | wire_type}:")
+        if wire_type == 0:
+            lines += _varint_lines("value", "            ")
+            lines.append(f"            {store(conversion)}")
+        elif wire_type in (1, 5):
+            lines += [
+                f"            {store(f'unpack{index}(data, i)[0]')}",
+                f"            i += {struct.calcsize(fmt)}",
+            ]
+        else:
+            lines += _varint_lines("length", "            ")
+            if conversion is None:
+                value = f"m{index}.{decode_attr}(data, i, i + length)"
+            else:
+                value = conversion.replace("value", "data[i:i + length]")
+            lines += [
+                f"            {store(value)}",
+                "            i += length",
+            ]
+        if field.repeated and wire_type != 2:
+            # Packed repeated scalars
+            lines += [
+                f"        elif tag == {field.number << 3 | 2}:",
+                *_varint_lines("length", "            "),
+                f"            {target}.extend(",
+                f"                decode_packed(data, i, i + length, {field.type!r})",
+                "            )",
+                "            i += length",
+            ]
+    lines += [
+        "        else:",
+        "            i = read(data, start)[0]",
+        "    if i != j:",
+        "        raise ValueError('message is truncated')",
+        f"    return {make}",
+    ]
+    return "\n".join(lines)
+
+def compile_message(name: str, fields: Sequence[Field]) -> type:
+    """Returns a class with __slots__ for the message and its decoders
+
+    The class has decode(data, i=0, j=None) returning an instance and
+    decode_tuple(data, i=0, j=None) returning a tuple of the field values
+    (with nested messages as tuples too), both decoding data[i:j]. The
+    decoders are Python functions generated for the schema, so each field
+    is only a tag comparison away. Unknown fields are skipped and later
+    fields replace earlier ones (nested messages aren't merged).
+
+    """
+    fields = tuple(fields)
+    names = [field.name for field in fields]
+    for field_name in names:
+        if not field_name.isidentifier() or field_name.startswith("_"):
+            raise ValueError(f"invalid field name: {field_name!r}")
+        if field_name in ("decode", "decode_tuple"):
+            raise ValueError(f"field name is reserved: {field_name!r}")
+    if len(set(names)) != len(names):
+        raise ValueError("field names must be unique")
+    namespace = {
+        "read": read,
+        "read_varint": read_varint,
+        "decode_packed": _decode_packed,
+    }
+    for index, field in enumerate(fields):
+        if isinstance(field.type, str):
+            if field.type not in _SCALAR_TYPES:
+                raise ValueError(f"unknown field type: {field.type!r}")
+            _, fmt, _ = _SCALAR_TYPES[field.type]
+            if fmt is not None:
+                namespace[f"unpack{index}"] = struct.Struct(fmt).unpack_from
+            default = _DEFAULTS.get(field.type, 0)
+        else:
+            namespace[f"m{index}"] = field.type
+            default = None
+        if field.default is not _TYPE_DEFAULT:
+            default = field.default
+        namespace[f"d{index}"] = default
+
+    values = ", ".join(f"f{index}" for index in range(len(fields)))
+    cls_namespace = {
+        "__slots__": tuple(names),
+        "_fields": fields,
+    }
+    init_lines = [f"def __init__(self, {', '.join(names)}):"] if names else [
+        "def __init__(self):",
+        "    pass",
+    ]
+    init_lines += [f"    self.{field_name} = {field_name}" for field_name in names]
+    init_namespace = {}
+    exec("\n".join(init_lines), init_namespace)
+    cls_namespace["__init__"] = init_namespace["__init__"]
+
+    def __repr__(self):
+        values = ", ".join(
+            f"{field_name}={getattr(self, field_name)!r}" for field_name in names
+        )
+        return f"{type(self).__name__}({values})"
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(
+            getattr(self, field_name) == getattr(other, field_name)
+            for field_name in names
+        )
+
+    cls_namespace["__repr__"] = __repr__
+    cls_namespace["__eq__"] = __eq__
+    cls = type(name, (), cls_namespace)
+
+    namespace["cls"] = cls
+    exec(_decoder_source(fields, f"cls({values})", "decode"), namespace)
+    cls.decode = staticmethod(namespace["decode"])
+    tuple_make = f"({values},)" if len(fields) == 1 else f"({values})"
+    exec(_decoder_source(fields, tuple_make, "decode_tuple"), namespace)
+    cls.decode_tuple = staticmethod(namespace["decode"])
+    return cls
+
+# - Lazy views
+
+_UNPACKERS = {
+    type_: struct.Struct(fmt).unpack_from
+    for type_, (_, fmt, _) in _SCALAR_TYPES.items()
+    if fmt is not None
+}
+
+def _decode_value(data, type_, wire_type, value, end):
+    # Decodes a recorded field, where value is what read returned for it
+    if wire_type == -1:  # Already decoded from a packed field
+        return value
+    if not isinstance(type_, str):
+        if wire_type != 2:
+            raise ValueError(f"expected a message but got wire type {wire_type}")
+        return MessageView(data, value, end, message=type_)
+    expected_wire_type, _, _ = _SCALAR_TYPES[type_]
+    if wire_type != expected_wire_type:
+        raise ValueError(f"expected a {type_} but got wire type {wire_type}")
+    if wire_type == 0:
+        return _CONVERSIONS[type_](value)
+    if wire_type == 2:
+        return _CONVERSIONS[type_](data[value:end])
+    return _UNPACKERS[type_](data, value)[0]
+
+def _default_of(field):
+    if field.repeated:
+        return []
+    if field.default is not _TYPE_DEFAULT:
+        return field.default
+    if not isinstance(field.type, str):
+        return None
+    return _DEFAULTS.get(field.type, 0)
+
+class MessageView:
+    """Lazy view of a message in data[start:end]
+
+    The first time a field is asked for, the message is skimmed once to
+    record where every field is. Fields are only decoded when they're
+    accessed, so looking at a few fields of a big message is cheap.
+
+    Fields are looked up by number, or by name if message (a class made by
+    compile_message) is given. Fields can also be read as attributes, like
+    view.time. Nested messages are returned as views too, and repeated
+    fields as a FieldIndex.
+
+    Example:
+        view = MessageView(data, message=FastSequence)
+        notes = view.notes  # Skims the sequence once
+        print(len(notes), notes[1000].time)  # Decodes one float
+
+    """
+    __slots__ = ("data", "start", "end", "message", "_offsets", "_indexes")
+
+    def __init__(self, data, start: int = 0, end: int = None, *, message=None):
+        if not isinstance(data, memoryview):
+            data = memoryview(data)
+        self.data = data
+        self.start = start
+        self.end = len(data) if end is None else end
+        self.message = message
+        self._offsets = None
+        self._indexes = None
+
+    def __repr__(self):
+        name = "?" if self.message is None else self.message.__name__
+        return f"<{type(self).__name__} {name} [{self.start}:{self.end}]>"
+
+    def offsets(self) -> dict:
+        """Returns the fields as {number: [(wire type, value, end, tag
+        start), ...]}, where value is the one read returns"""
+        offsets = self._offsets
+        if offsets is None:
+            offsets = {}
+            data = self.data
+            i = self.start
+            end = self.end
+            while i < end:
+                start = i
+                i, wire_type, field, value = read(data, i)
+                entry = (wire_type, value, i, start)
+                entries = offsets.get(field)
+                if entries is None:
+                    offsets[field] = [entry]
+                else:
+                    entries.append(entry)
+            if i != end:
+                raise ValueError("message is truncated")
+            self._offsets = offsets
+        return offsets
+
+    def _field(self, key) -> Field:
+        if self.message is not None:
+            for field in self.message._fields:
+                if field.name == key or field.number == key:
+                    return field
+        if isinstance(key, int):
+            raise KeyError(f"no type known for field {key}, use offsets()")
+        raise KeyError(f"no field named {key!r}")
+
+    def has(self, key) -> bool:
+        """Returns whether the field is in the message"""
+        number = key if isinstance(key, int) else self._field(key).number
+        return number in self.offsets()
+
+    def get(self, key, type_=None):
+        """Returns the decoded field (or its default if it's missing)
+
+        type_ is needed for fields the message doesn't know about.
+
+        """
+        if type_ is None:
+            field = self._field(key)
+        else:
+            field = Field(key, str(key), type_)
+        if field.repeated:
+            return self.repeated(key)
+        entries = self.offsets().get(field.number)
+        if not entries:
+            return _default_of(field)
+        # Later fields replace earlier ones
+        wire_type, value, end, _ = entries[-1]
+        return _decode_value(self.data, field.type, wire_type, value, end)
+
+    def repeated(self, key, type_=None) -> "FieldIndex":
+        """Returns an index of each element of the field
+
+        The index is only built once for each field.
+
+        """
+        if type_ is None:
+            field = self._field(key)
+        else:
+            field = Field(key, str(key), type_, repeated=True)
+        indexes = self._indexes
+        if indexes is None:
+            indexes = self._indexes = {}
+        index = indexes.get(field.number)
+        if index is None:
+            elements = []
+            packable = isinstance(field.type, str) and field.type in _ARRAY_TYPECODES
+            for entry in self.offsets().get(field.number, ()):
+                wire_type, value, end, start = entry
+                if packable and wire_type == 2:
+                    # Packed values are decoded all at once
+                    elements.extend(
+                        (-1, packed, end, start)
+                        for packed in _decode_packed(self.data, value, end, field.type)
+                    )
+                else:
+                    elements.append(entry)
+            index = indexes[field.number] = FieldIndex(self.data, field.type, elements)
+        return index
+
+    def __getattr__(self, name):
+        if name.startswith("_") or self.message is None:
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(name) from None
+
+class FieldIndex:
+    """Index of every element of a repeated field
+
+    Element n is found in O(1) and decoded when it's accessed (messages as
+    MessageViews). ranges and span split the elements up so that parts can be
+    decoded elsewhere, like in other processes:
+
+        for elements in index.ranges(workers):
+            start, end = index.span(elements)
+            # Send data[start:end] off, and skim it there with
+            # MessageView(part, message=...).repeated(field)
+
+    """
+    __slots__ = ("data", "type", "elements")
+
+    def __init__(self, data, type_, elements):
+        self.data = data
+        self.type = type_
+        # (wire type, value, end, tag start) for each element, where the wire
+        # type is -1 for already decoded values
+        self.elements = elements
+
+    def __repr__(self):
+        return f"<{type(self).__name__} of {len(self.elements)}>"
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self._decode(element) for element in self.elements[n]]
+        return self._decode(self.elements[n])
+
+    def __iter__(self):
+        for element in self.elements:
+            yield self._decode(element)
+
+    def _decode(self, element):
+        wire_type, value, end, _ = element
+        return _decode_value(self.data, self.type, wire_type, value, end)
 
-def to_sint(data: bytes, i: int, j: int) -> int:
-    if i & 1:
-        return ~i >> 1
-    return i >> 1
+    def ranges(self, parts: int) -> list:
+        """Splits the element indices into up to parts ranges of about the
+        same size"""
+        count = len(self.elements)
+        parts = max(1, min(parts, count))
+        bounds = [count * k // parts for k in range(parts + 1)]
+        return [range(bounds[k], bounds[k + 1]) for k in range(parts)]
 
+    def span(self, elements: range) -> Tuple[int, int]:
+        """Returns the start and end offsets of the data holding the
+        elements (which can also hold other fields)"""
+        if not elements:
+            raise ValueError("no elements to span")
+        first = self.elements[elements[0]]
+        last = self.elements[elements[-1]]
+        if first[0] == -1 or last[0] == -1:
+            raise ValueError("packed fields can't be split")
+        return first[3], last[2]